@@ -11,6 +11,7 @@ from .utils.get_kakao_auth import GetKakaoAuth
 from .utils.get_signal_auth import GetSignalAuth
 from .utils.get_line_auth import GetLineAuth
 from .utils.curr_dir import CurrDir
+from .utils.conversion_cache import ConversionCache
 from .__init__ import __version__
 
 # Only download from a source
@@ -70,7 +71,7 @@ class CLI:
         parser_comp = parser.add_argument_group('Compression options')
         parser_comp.add_argument('--no-compress', dest='no_compress', action='store_true', help=self.help['comp']['no_compress'])
         parser_comp.add_argument('--preset', dest='preset', default='custom', choices=self.compression_presets.keys(), help=self.help['comp']['preset'])
-        flags_int = ('steps', 'processes', 
+        flags_int = ('steps', 'processes', 'memory_budget', 'parallel_steps',
                     'fps_min', 'fps_max', 
                     'res_min', 'res_max', 
                     'res_w_min', 'res_w_max', 
@@ -78,9 +79,10 @@ class CLI:
                     'quality_min', 'quality_max',
                     'color_min', 'color_max',
                     'duration_min', 'duration_max',
-                    'vid_size_max', 'img_size_max')
-        flags_str = ('vid_format', 'img_format', 'cache_dir')
-        flags_bool = ('fake_vid')
+                    'vid_size_max', 'img_size_max',
+                    'conversion_cache_max')
+        flags_str = ('vid_format', 'img_format', 'cache_dir', 'encoder')
+        flags_bool = ('fake_vid', 'conversion_cache', 'fast_search')
         for k, v in self.help['comp'].items():
             if k in flags_int:
                 keyword_args = {'type': int, 'default': None}
@@ -91,6 +93,10 @@ class CLI:
             else:
                 continue
             parser_comp.add_argument(f'--{k.replace("_", "-")}', **keyword_args, dest=k, help=v)
+        parser_comp.add_argument('--search', dest='search', default='predict', choices=('predict', 'bisect'), help=self.help['comp']['search'])
+        parser_comp.add_argument('--conversion-cache-info', dest='conversion_cache_info', action='store_true', help=self.help['comp']['conversion_cache_info'])
+        parser_comp.add_argument('--conversion-cache-clear', dest='conversion_cache_clear', action='store_true', help=self.help['comp']['conversion_cache_clear'])
+        parser_comp.add_argument('--executor', dest='executor', default='process', choices=('process', 'thread'), help=self.help['comp']['executor'])
         parser_comp.add_argument('--default-emoji', dest='default_emoji', default=self.compression_presets['custom']['default_emoji'], help=self.help['comp']['default_emoji'])
 
         parser_cred = parser.add_argument_group('Credentials options')
@@ -110,6 +116,10 @@ class CLI:
         self.get_opt_comp(args)
         self.get_opt_cred(args)
 
+        if args.conversion_cache_info or args.conversion_cache_clear:
+            self.conversion_cache(args)
+            return
+
         flow = Flow(
             self.opt_input, self.opt_comp, self.opt_output, self.opt_cred, 
             self.input_presets, self.output_presets,
@@ -214,13 +224,34 @@ class CLI:
                 'max': self.compression_presets[preset]['duration']['max'] if args.duration_max == None else args.duration_max
             },
             'steps': self.compression_presets[preset]['steps'] if args.steps == None else args.steps,
+            'search': args.search,
+            'fast_search': args.fast_search,
             'fake_vid': self.compression_presets[preset]['fake_vid'] if args.fake_vid == None else args.fake_vid,
             'cache_dir': args.cache_dir,
+            'conversion_cache': args.conversion_cache,
+            'conversion_cache_max': args.conversion_cache_max,
             'default_emoji': args.default_emoji,
             'no_compress': args.no_compress,
-            'processes': args.processes if args.processes else multiprocessing.cpu_count()
+            'processes': args.processes if args.processes else multiprocessing.cpu_count(),
+            'memory_budget': args.memory_budget,
+            'parallel_steps': args.parallel_steps if args.parallel_steps else 1,
+            'encoder': args.encoder,
+            'executor': args.executor
         }
 
+    def conversion_cache(self, args):
+        conversion_cache = ConversionCache.from_opt_comp(self.opt_comp)
+
+        if args.conversion_cache_clear:
+            conversion_cache.clear()
+            self.cb_msg('Cleared conversion cache')
+
+        info = conversion_cache.info()
+        msg = f'Conversion cache: {info["path"]}\n'
+        msg += f'Results: {info["entries"]}\n'
+        msg += f'Size: {info["size"] / 1024 / 1024:.1f} MB / {info["size_max"] / 1024 / 1024:.1f} MB'
+        self.cb_msg(msg)
+
     def get_opt_cred(self, args):
         creds_path = os.path.join(CurrDir.get_creds_dir(), 'creds.json')
         creds = JsonManager.load_json(creds_path)
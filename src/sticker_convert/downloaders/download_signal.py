@@ -5,7 +5,7 @@ from signalstickers_client import StickersClient
 
 from .download_base import DownloadBase
 from ..utils.metadata_handler import MetadataHandler
-from ..utils.codec_info import CodecInfo
+from ..utils.media_info import MediaInfo
 
 class DownloadSignal(DownloadBase):
     def __init__(self, *args, **kwargs):
@@ -31,7 +31,7 @@ class DownloadSignal(DownloadBase):
 
             emoji_dict[f_id] = sticker.emoji
 
-            codec = CodecInfo.get_file_codec(f_path)
+            codec = MediaInfo.probe(f_path).codec
             if 'apng' in codec:
                 f_path_new = f_path + '.apng'
             elif 'png' in codec:
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import os
 import shutil
-import time
 from datetime import datetime
 from threading import Thread
+from queue import Queue
+from multiprocessing import Manager, cpu_count
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urlparse
 
 from .downloaders.download_line import DownloadLine
@@ -18,6 +21,7 @@ from .uploaders.xcode_imessage import XcodeImessage
 
 from .utils.converter import StickerConvert
 from .utils.codec_info import CodecInfo
+from .utils.media_info import MediaInfo
 from .utils.json_manager import JsonManager
 from .utils.metadata_handler import MetadataHandler
 
@@ -318,43 +322,141 @@ class Flow:
         self.cb_msg(msg)
         self.cb_bar(set_progress_mode='determinate', steps=in_fs_count)
         
-        threads = []
+        # Workers send cb_msg calls back through cb_queue, which is drained
+        # here in the main process so that the GUI / tqdm are only touched
+        # from one place
+        if self.opt_comp.get('executor') == 'thread':
+            executor_cls = ThreadPoolExecutor
+            manager = None
+            cb_queue = Queue()
+        else:
+            executor_cls = ProcessPoolExecutor
+            manager = Manager()
+            cb_queue = manager.Queue()
+
+        cb_thread = Thread(target=self.cb_thread, args=(cb_queue,), daemon=True)
+        cb_thread.start()
+
+        # Cores left for each job when there are fewer files than processes,
+        # so that a single file can still use all of them
+        opt_comp = dict(self.opt_comp)
+        opt_comp['threads'] = max(1, cpu_count() // max(1, min(self.opt_comp['processes'], in_fs_count)))
+
+        pending = []
         for i in in_fs:
             in_f = os.path.join(input_dir, i)
 
-            if CodecInfo.is_anim(in_f) or self.opt_comp['fake_vid']:
+            if MediaInfo.probe(in_f).anim or self.opt_comp['fake_vid']:
                 extension = self.opt_comp['format']['vid']
             else:
                 extension = self.opt_comp['format']['img']
 
             out_f = os.path.join(output_dir, os.path.splitext(i)[0] + extension)
+            memory = StickerConvert.get_memory_estimate(in_f, self.opt_comp)
+            pending.append((in_f, out_f, memory))
 
-            thread = Thread(
-                    target=self.compress_thread, 
-                    args=(in_f, out_f, self.opt_comp),
-                    daemon=True
-                    )
-
-            threads.append(thread)
-        
-            while True:
-                if sum((t.is_alive() for t in threads)) < self.opt_comp['processes']:
-                    thread.start()
-                    break
-                else:
-                    time.sleep(1)
+        memory_budget = Flow.get_memory_budget(self.opt_comp.get('memory_budget'))
 
-        for thread in threads:
-            thread.join()
+        executor = executor_cls(max_workers=self.opt_comp['processes'])
+        jobs = {}
+        memory_used = 0
+        # Jobs lost once to a worker that died, which are run again on their own
+        # to find the one that made it die, and are not run a third time
+        retried = set()
+        try:
+            while pending or jobs:
+                # Jobs are started in order while their estimated memory fits the budget,
+                # smaller jobs further down may fill slots that a large job cannot.
+                # A job that does not fit at all still runs, but only on its own
+                for in_f, out_f, memory in pending.copy():
+                    if len(jobs) >= self.opt_comp['processes']:
+                        break
+                    if jobs and memory_budget and memory_used + memory > memory_budget:
+                        continue
+                    if jobs and (in_f in retried or any(i[0] in retried for i in jobs.values())):
+                        break
+
+                    job = executor.submit(Flow.compress_worker, in_f, out_f, opt_comp, cb_queue)
+                    jobs[job] = (in_f, out_f, memory)
+                    memory_used += memory
+                    pending.remove((in_f, out_f, memory))
+
+                done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                broken = any(isinstance(job.exception(), BrokenProcessPool) for job in done)
+                if broken:
+                    # A worker died, e.g. killed for running out of memory,
+                    # which fails every job in the pool and the pool itself
+                    done, _ = wait(jobs)
+
+                requeue = []
+                for job in done:
+                    in_f, out_f, memory = jobs.pop(job)
+                    memory_used -= memory
+                    try:
+                        result = job.result()
+                    except BrokenProcessPool as e:
+                        if len(done) > 1 and in_f not in retried:
+                            # Not known which job made the worker die, so each is run once more
+                            retried.add(in_f)
+                            requeue.append((in_f, out_f, memory))
+                            continue
+                        self.cb_msg(f'[F] Error while compressing {in_f}: {e!r}')
+                        result = False
+                    except Exception as e:
+                        self.cb_msg(f'[F] Error while compressing {in_f}: {e!r}')
+                        result = False
+
+                    if result == False:
+                        self.compress_fails.append(in_f)
+
+                    self.cb_bar(update_bar=True)
+
+                if broken:
+                    pending[:0] = sorted(requeue)
+                    executor.shutdown()
+                    executor = executor_cls(max_workers=self.opt_comp['processes'])
+        finally:
+            executor.shutdown()
+            cb_queue.put(None)
+            cb_thread.join()
+            if manager:
+                manager.shutdown()
 
         return True
     
-    def compress_thread(self, in_f, out_f, opt_comp):
-        result = StickerConvert(in_f, out_f, opt_comp, self.cb_msg).convert()
-        if result == False:
-            self.compress_fails.append(in_f)
+    @staticmethod
+    def get_memory_budget(memory_budget=None):
+        # Return memory available to compression jobs (In bytes)
+        # memory_budget is set in MB, otherwise the container or system memory is used
+        if memory_budget:
+            return memory_budget * 1024 * 1024
+
+        for cgroup_f in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+            try:
+                with open(cgroup_f) as f:
+                    limit = f.read().strip()
+            except OSError:
+                continue
+            # cgroup v1 reports a huge number instead of 'max' when unlimited
+            if limit.isdigit() and int(limit) < 2 ** 60:
+                return int(limit)
+
+        try:
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            # Not available on Windows, jobs are then only limited by processes
+            return None
+
+    def cb_thread(self, cb_queue):
+        for (args, kwargs) in iter(cb_queue.get, None):
+            self.cb_msg(*args, **kwargs)
+
+    @staticmethod
+    def compress_worker(in_f, out_f, opt_comp, cb_queue):
+        def cb_msg(*args, **kwargs):
+            cb_queue.put((args, kwargs))
 
-        self.cb_bar(update_bar=True)
+        return StickerConvert(in_f, out_f, opt_comp, cb_msg).convert()
 
     def export(self):
         self.cb_bar(set_progress_mode='indeterminate')
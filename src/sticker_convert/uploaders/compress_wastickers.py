@@ -8,7 +8,7 @@ from .upload_base import UploadBase
 from ..utils.converter import StickerConvert
 from ..utils.format_verify import FormatVerify
 from ..utils.metadata_handler import MetadataHandler
-from ..utils.codec_info import CodecInfo
+from ..utils.media_info import MediaInfo
 from ..utils.cache_store import CacheStore
 
 from mergedeep import merge
@@ -78,7 +78,7 @@ class CompressWastickers(UploadBase):
                 for src in stickers:
                     self.cb_msg(f'Verifying {src} for compressing into .wastickers')
 
-                    if self.fake_vid or CodecInfo.is_anim(src):
+                    if self.fake_vid or MediaInfo.probe(src).anim:
                         ext = '.webp'
                     else:
                         ext = '.png'
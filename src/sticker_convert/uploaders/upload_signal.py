@@ -6,7 +6,7 @@ from .upload_base import UploadBase
 from ..utils.metadata_handler import MetadataHandler
 from ..utils.converter import StickerConvert
 from ..utils.format_verify import FormatVerify
-from ..utils.codec_info import CodecInfo
+from ..utils.media_info import MediaInfo
 from ..utils.cache_store import CacheStore
 
 import anyio
@@ -83,7 +83,7 @@ class UploadSignal(UploadBase):
                     spec_choice = self.webp_spec
                 
                 if not FormatVerify.check_file(src, spec=spec_choice):
-                    if self.fake_vid or CodecInfo.is_anim(src):
+                    if self.fake_vid or MediaInfo.probe(src).anim:
                         dst = os.path.join(tempdir, src_name + '.apng')
                     else:
                         dst = os.path.join(tempdir, src_name + '.png')
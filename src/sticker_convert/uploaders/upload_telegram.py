@@ -7,7 +7,7 @@ from .upload_base import UploadBase
 from ..utils.converter import StickerConvert
 from ..utils.metadata_handler import MetadataHandler
 from ..utils.format_verify import FormatVerify
-from ..utils.codec_info import CodecInfo
+from ..utils.media_info import MediaInfo
 from ..utils.cache_store import CacheStore
 
 import anyio
@@ -97,7 +97,7 @@ class UploadTelegram(UploadBase):
                     if FormatVerify.check_file(src, spec=spec_choice):
                         dst = src
                     else:
-                        if self.fake_vid or CodecInfo.is_anim(src):
+                        if self.fake_vid or MediaInfo.probe(src).anim:
                             dst = os.path.join(tempdir, src_name + '.webm')
                             ext = '.webm'
                             StickerConvert(src, src, self.opt_comp_merged, self.cb_msg).convert()
@@ -10,6 +10,7 @@ from ..utils.converter import StickerConvert
 from ..utils.format_verify import FormatVerify
 from ..utils.metadata_handler import MetadataHandler
 from ..utils.codec_info import CodecInfo
+from ..utils.media_info import MediaInfo
 
 from mergedeep import merge
 
@@ -103,7 +104,7 @@ class XcodeImessage(UploadBase):
                 dst_path = os.path.join(self.out_dir, src)
 
                 if res_choice == None:
-                    res_choice, _ = CodecInfo.get_file_res(src_path)
+                    res_choice, _ = MediaInfo.probe(src_path).res
                     res_choice = res_choice if res_choice != None else 300
 
                     if res_choice == 300:
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import zlib
+import struct
+
+import numpy as np
+
+class ApngWriter:
+    '''
+    Assemble an APNG in memory from RGBA frames of shape (height, width, 4),
+    or from palette index frames of shape (height, width) with palette as
+    an array of RGBA colors of shape (n, 4).
+
+    Frames are compressed as they are added. Each frame after the first only
+    stores the region that changed from the previous frame. Rows are filtered
+    with the filter giving lowest sum of absolute differences, and palette
+    frames use the lowest bit depth that fits the palette. RGBA frames are
+    stored as RGB if alpha is False.
+
+    get_colors() and index_colors() turn RGBA frames using few colors into
+    palette frames without loss.
+    '''
+    def __init__(self, width, height, palette=None, alpha=True, num_plays=0, crop=True, compress_level=9):
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.num_plays = num_plays
+        self.crop = crop
+        self.compress_level = compress_level
+
+        if palette is None and alpha:
+            self.color_type = 6
+            self.bit_depth = 8
+        elif palette is None:
+            self.color_type = 2
+            self.bit_depth = 8
+        else:
+            self.color_type = 3
+            self.bit_depth = next(i for i in (1, 2, 4, 8) if len(palette) <= 2 ** i)
+
+        self.frames = []
+        self.frame_prev = None
+        # Running size of compressed frame data (In bytes)
+        self.size = 0
+
+    @staticmethod
+    def get_colors(frames, colors_max=256):
+        '''
+        Return RGBA colors used in frames as sorted uint32, or None if there
+        are more than colors_max. Sorting puts transparent colors first, so
+        the tRNS chunk only covers them.
+        '''
+        colors = np.empty(0, dtype=np.uint32)
+        for frame in frames:
+            pixels = frame.view(np.uint32).ravel()
+            if len(colors) > 0:
+                # Only look at pixels with colors not seen yet
+                found = colors[np.minimum(np.searchsorted(colors, pixels), len(colors) - 1)]
+                pixels = pixels[found != pixels]
+            if len(pixels) > 0:
+                colors = np.union1d(colors, pixels)
+                if len(colors) > colors_max:
+                    return None
+        return colors
+
+    @staticmethod
+    def index_colors(frame, colors):
+        # Map a RGBA frame to indices of colors from get_colors()
+        return np.searchsorted(colors, frame.view(np.uint32)[..., 0]).astype(np.uint8)
+
+    @staticmethod
+    def get_chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    def get_region(self, frame):
+        if self.frame_prev is None or not self.crop:
+            return 0, 0, self.width, self.height
+
+        diff = frame != self.frame_prev
+        if diff.ndim == 3:
+            diff = diff.any(axis=2)
+        rows = np.flatnonzero(diff.any(axis=1))
+        cols = np.flatnonzero(diff.any(axis=0))
+        if len(rows) == 0:
+            # Nothing changed, still need a frame to keep the timing
+            return 0, 0, 1, 1
+
+        return cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1
+
+    def pack_rows(self, frame):
+        if self.color_type == 6:
+            return frame.reshape(frame.shape[0], -1)
+        if self.color_type == 2:
+            return frame[..., :3].reshape(frame.shape[0], -1)
+
+        if self.bit_depth == 8:
+            return frame
+
+        # Pack several indices into each byte, leftmost pixel in high bits
+        pixels_per_byte = 8 // self.bit_depth
+        height, width = frame.shape
+        width_padded = -(-width // pixels_per_byte) * pixels_per_byte
+        padded = np.zeros((height, width_padded), dtype=np.uint8)
+        padded[:, :width] = frame
+        padded = padded.reshape(height, -1, pixels_per_byte)
+        shifts = np.arange(pixels_per_byte - 1, -1, -1, dtype=np.uint8) * self.bit_depth
+        return np.bitwise_or.reduce(padded << shifts, axis=2).astype(np.uint8)
+
+    def filter_rows(self, rows):
+        if self.color_type == 3:
+            # Filtering rarely helps palette images
+            filtered = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+            filtered[:, 1:] = rows
+            return filtered
+
+        bpp = 4 if self.color_type == 6 else 3
+        x = rows.astype(np.int16)
+        a = np.zeros_like(x)
+        a[:, bpp:] = x[:, :-bpp]
+        b = np.zeros_like(x)
+        b[1:] = x[:-1]
+        c = np.zeros_like(x)
+        c[1:, bpp:] = x[:-1, :-bpp]
+
+        p = a + b - c
+        pa = np.abs(p - a)
+        pb = np.abs(p - b)
+        pc = np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+        candidates = np.stack((x, x - a, x - b, x - (a + b) // 2, x - paeth)).astype(np.uint8)
+
+        # Minimum sum of absolute differences, treating bytes as signed
+        cost = np.abs(candidates.view(np.int8).astype(np.int16)).sum(axis=2)
+        filter_types = cost.argmin(axis=0)
+
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = filter_types
+        filtered[:, 1:] = candidates[filter_types, np.arange(rows.shape[0])]
+        return filtered
+
+    def add_frame(self, frame, delay_num, delay_den):
+        x, y, width, height = self.get_region(frame)
+        region = frame[y:y + height, x:x + width]
+        self.frame_prev = frame
+
+        data = zlib.compress(self.filter_rows(self.pack_rows(region)).tobytes(), self.compress_level)
+        self.frames.append((x, y, width, height, delay_num, delay_den, data))
+        self.size += len(data)
+
+    def get_data(self):
+        chunks = [b'\x89PNG\r\n\x1a\n']
+        chunks.append(ApngWriter.get_chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, self.bit_depth, self.color_type, 0, 0, 0)))
+        chunks.append(ApngWriter.get_chunk(b'acTL', struct.pack('>II', len(self.frames), self.num_plays)))
+
+        if self.color_type == 3:
+            palette = np.asarray(self.palette, dtype=np.uint8)
+            chunks.append(ApngWriter.get_chunk(b'PLTE', palette[:, :3].tobytes()))
+            transparent = np.flatnonzero(palette[:, 3] != 255)
+            if len(transparent) > 0:
+                chunks.append(ApngWriter.get_chunk(b'tRNS', palette[:transparent[-1] + 1, 3].tobytes()))
+
+        seq = 0
+        for i, (x, y, width, height, delay_num, delay_den, data) in enumerate(self.frames):
+            # dispose_op NONE, blend_op SOURCE, so the region replaces what was there
+            chunks.append(ApngWriter.get_chunk(b'fcTL', struct.pack('>IIIIIHHBB', seq, width, height, x, y, delay_num, delay_den, 0, 0)))
+            seq += 1
+            if i == 0:
+                chunks.append(ApngWriter.get_chunk(b'IDAT', data))
+            else:
+                chunks.append(ApngWriter.get_chunk(b'fdAT', struct.pack('>I', seq) + data))
+                seq += 1
+
+        chunks.append(ApngWriter.get_chunk(b'IEND', b''))
+        return b''.join(chunks)
\ No newline at end of file
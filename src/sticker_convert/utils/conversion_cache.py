@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import os
+import json
+import hashlib
+from uuid import uuid4
+
+from .curr_dir import CurrDir
+from ..__init__ import __version__
+
+class ConversionCache:
+    '''
+    Persistent cache of conversion results, keyed by the hash of the input
+    file, the output format, the compression options that affect the
+    output and KEY_VERSION. Least recently used results are evicted once
+    the total size of the cache exceeds size_max (In bytes).
+    '''
+    # opt_comp keys that do not change the output file
+    KEY_IGNORE = (
+        'preset',
+        'cache_dir',
+        'default_emoji',
+        'no_compress',
+        'processes',
+        'memory_budget',
+        'parallel_steps',
+        'threads',
+        'executor',
+        'conversion_cache',
+        'conversion_cache_max'
+    )
+
+    # Part of the key, bump it whenever output of the same input and options
+    # can change, such as encoders, their profiles or their settings
+    KEY_VERSION = 4
+
+    SIZE_MAX_DEFAULT = 256 * 1024 * 1024
+
+    def __init__(self, cache_dir=None, size_max=None):
+        if cache_dir:
+            self.path = os.path.join(cache_dir, 'conversion_cache')
+        else:
+            self.path = os.path.join(CurrDir.get_cache_dir(), 'conversion_cache')
+        os.makedirs(self.path, exist_ok=True)
+
+        self.size_max = size_max if size_max != None else ConversionCache.SIZE_MAX_DEFAULT
+
+    @staticmethod
+    def from_opt_comp(opt_comp):
+        size_max = opt_comp.get('conversion_cache_max')
+        if size_max != None:
+            size_max *= 1024 * 1024
+        return ConversionCache(cache_dir=opt_comp.get('cache_dir'), size_max=size_max)
+
+    @staticmethod
+    def get_key(in_f, opt_comp, out_f_ext):
+        opt_comp_canonical = {k: v for k, v in opt_comp.items() if k not in ConversionCache.KEY_IGNORE}
+
+        h = hashlib.sha256()
+        with open(in_f, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        h.update(json.dumps(opt_comp_canonical, sort_keys=True, default=str).encode())
+        h.update(out_f_ext.encode())
+        h.update(__version__.encode())
+        h.update(str(ConversionCache.KEY_VERSION).encode())
+
+        return h.hexdigest() + out_f_ext
+
+    def get(self, key):
+        path = os.path.join(self.path, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # Mark as recently used
+        os.utime(path)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.size_max:
+            return
+
+        # Write to temporary file first, so other processes never read a partial result
+        tmp_path = os.path.join(self.path, f'.{uuid4()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.path, key))
+
+        self.evict()
+
+    def get_entries(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def evict(self):
+        entries = sorted(self.get_entries())
+        size_total = sum(i[1] for i in entries)
+
+        for _, size, path in entries:
+            if size_total <= self.size_max:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size_total -= size
+
+    def info(self):
+        entries = self.get_entries()
+        return {
+            'path': self.path,
+            'entries': len(entries),
+            'size': sum(i[1] for i in entries),
+            'size_max': self.size_max
+        }
+
+    def clear(self):
+        for _, _, path in self.get_entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
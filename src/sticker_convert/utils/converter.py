@@ -3,19 +3,32 @@ import os
 import shutil
 import math
 import io
+import copy
+from fractions import Fraction
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from .codec_info import CodecInfo
+from .media_info import MediaInfo
+from .conversion_cache import ConversionCache
 from .cache_store import CacheStore
 from .format_verify import FormatVerify
+from .lottie_renderer import LottieRenderer
+from .apng_writer import ApngWriter
+from .palette_quantizer import PaletteQuantizer
+from .frame_stack import FrameStack
+from .encoder_registry import EncoderRegistry
+from .decoder_registry import DecoderRegistry
 
-import imageio.v3 as iio
-from rlottie_python import LottieAnimation
-from apngasm_python.apngasm import APNGAsm, create_frame_from_rgba
 import numpy as np
 from PIL import Image
 import av
+from av.video.reformatter import VideoReformatter
 import webp
 import oxipng
+from apngasm_python.apngasm import APNGAsm, create_frame_from_rgba
 
 def get_step_value(max, min, step, steps):
     if max and min:
@@ -24,18 +37,58 @@ def get_step_value(max, min, step, steps):
         return
 
 class StickerConvert:
+    # Encode is stopped when size projected from the first half of frames
+    # exceeds size limit by this margin, or when actual size exceeds size limit
+    ABORT_PROJECTION_MARGIN = 1.25
+
+    # Ratio of size from best effort encode to size from fast effort encode,
+    # per output format, measured on sample stickers. Kept on the safe side,
+    # as a too low ratio means searching again after the best effort encode
+    EFFORT_FACTOR = {
+        '.apng': 0.9,
+        '.png': 0.9,
+        '.webp': 0.8
+    }
+
+    # WebM is first encoded at a bitrate aiming at this share of the size limit,
+    # and encoded again with a scaled bitrate if the result does not fit or
+    # fills less than BITRATE_FILL_MIN of the limit, up to BITRATE_TRIES times.
+    # The bitrate is scaled by at most BITRATE_SCALE_MAX at a time
+    BITRATE_TARGET_RATIO = 0.95
+    BITRATE_FILL_MIN = 0.8
+    BITRATE_TRIES = 2
+    BITRATE_SCALE_MAX = 2
+
+    # Memory budget for frames kept between steps of one conversion (In bytes)
+    FRAMES_PROCESSED_CACHE_MAX = 512 * 1024 * 1024
+
+    # Memory used by a conversion besides frames (In bytes), and number of
+    # frame copies alive at once (Decoded, resized and being encoded)
+    MEMORY_BASE = 128 * 1024 * 1024
+    MEMORY_COPIES = 3
+
     def __init__(self, in_f, out_f, opt_comp, cb_msg=print):
         self.in_f = in_f
         self.in_f_name = os.path.split(self.in_f)[1]
         self.in_f_ext = CodecInfo.get_file_ext(self.in_f)
+        self.in_f_info = MediaInfo.probe(self.in_f)
 
         self.out_f = out_f
         self.out_f_name = os.path.split(self.out_f)[1]
         self.out_f_ext = CodecInfo.get_file_ext(self.out_f)
 
         self.cb_msg = cb_msg
-        self.frames_raw = []
-        self.frames_processed = []
+        self.frames_raw = None
+        self.frames_raw_index = []
+        self.frames_raw_count = 0
+        self.decode_res = None
+        self.frames_processed = None
+        # Shared by copies encoding steps in parallel
+        self.frames_processed_cache = OrderedDict()
+        self.frames_processed_cache_lock = threading.Lock()
+        self.palette_cache = {}
+        # Frames of the last processed frames converted for VP9, shared by copies
+        self.frames_yuva_cache = {}
         self.opt_comp = opt_comp
         self.preset = opt_comp.get('preset')
 
@@ -75,10 +128,58 @@ class StickerConvert:
         self.fake_vid = opt_comp.get('fake_vid')
         self.cache_dir = opt_comp.get('cache_dir')
 
+        if opt_comp.get('conversion_cache'):
+            self.conversion_cache = ConversionCache.from_opt_comp(opt_comp)
+        else:
+            self.conversion_cache = None
+        self.conversion_cache_key = None
+
+        self.search = opt_comp.get('search', 'predict')
+        self.fast_search = opt_comp.get('fast_search')
+        self.effort = 'normal'
+        self.size_abort = None
+        self.size_aborted = None
+        self.size_target = None
+        self.size_limited = False
+        self.encoder = opt_comp.get('encoder')
+        self.parallel_steps = opt_comp.get('parallel_steps') if opt_comp.get('parallel_steps') else 1
+        self.sizes = {}
+        self.results = {}
+        self.encodes = 0
+        # Threads are left to the codecs if not given
+        self.threads = opt_comp.get('threads')
+
+        # A still image that stays a still image skips frame selection,
+        # deduplication and the animation encoders
+        self.static = (not self.in_f_info.anim and
+                       self.in_f_ext in ('.png', '.apng', '.jpg', '.jpeg', '.webp', '.gif') and
+                       self.out_f_ext in ('.png', '.webp'))
+
         self.tmp_f = None
-        self.tmp_fs = []
 
-        self.apngasm = APNGAsm()
+    @staticmethod
+    def get_memory_estimate(in_f, opt_comp):
+        # Estimate peak memory of converting in_f from its probe (In bytes)
+        info = MediaInfo.probe(in_f)
+        width, height = info.res
+        frames = info.frames
+
+        fps = opt_comp.get('fps')
+        fps_max = fps if type(fps) == int else (fps or {}).get('max')
+        if fps_max and info.fps and fps_max < info.fps:
+            frames = math.ceil(frames * fps_max / info.fps)
+
+        res = opt_comp.get('res', {})
+        res_w = res.get('w') if type(res.get('w')) == int else res.get('w', {}).get('max')
+        res_h = res.get('h') if type(res.get('h')) == int else res.get('h', {}).get('max')
+        if res_w and res_h and (width > res_w or height > res_h):
+            # Frames are decoded at no larger than the output resolution
+            scale = min(res_w / width, res_h / height)
+            width, height = math.ceil(width * scale), math.ceil(height * scale)
+
+        size_frames = frames * width * height * 4
+        size_copies = min(size_frames * (StickerConvert.MEMORY_COPIES - 1), StickerConvert.FRAMES_PROCESSED_CACHE_MAX)
+        return StickerConvert.MEMORY_BASE + size_frames + size_copies
 
     def convert(self):
         if (FormatVerify.check_format(self.in_f, format=self.out_f_ext) and
@@ -91,180 +192,510 @@ class StickerConvert:
             shutil.copyfile(self.in_f, self.out_f)
             return True
 
+        if self.conversion_cache:
+            self.conversion_cache_key = ConversionCache.get_key(self.in_f, self.opt_comp, self.out_f_ext)
+            data = self.conversion_cache.get(self.conversion_cache_key)
+            if data != None:
+                with open(self.out_f, 'wb+') as f:
+                    f.write(data)
+                self.cb_msg(f'[S] Found cached result, skip compress {self.in_f_name} -> {self.out_f_name}')
+                return True
+
         self.cb_msg(f'[I] Start compressing {self.in_f_name} -> {self.out_f_name}')
 
-        steps_list = []
+        self.steps_list = []
         for step in range(self.steps, -1, -1):
-            steps_list.append((
+            self.steps_list.append((
                 get_step_value(self.res_w_max, self.res_w_min, step, self.steps),
                 get_step_value(self.res_h_max, self.res_h_min, step, self.steps),
                 get_step_value(self.quality_max, self.quality_min, step, self.steps),
                 get_step_value(self.fps_max, self.fps_min, step, self.steps),
                 get_step_value(self.color_max, self.color_min, step, self.steps)
             ))
-        self.tmp_fs = [None] * (self.steps + 1)
 
-        step_lower = 0
-        step_upper = self.steps
-
-        if self.size_max_vid == None and self.size_max_img == None:
-            # No limit to size, create the best quality result
-            step_current = 0
+        if self.in_f_info.anim:
+            size_max = self.size_max_vid
         else:
-            step_current = round((step_lower + step_upper) / 2)
+            size_max = self.size_max_img
 
         self.frames_import()
-        while True:
-            param = steps_list[step_current]
-            self.res_w = param[0]
-            self.res_h = param[1]
-            self.quality = param[2]
-            self.fps = param[3]
-            self.color = param[4]
-
-            self.tmp_f = io.BytesIO()
-            self.cb_msg(f'[C] Compressing {self.in_f_name} -> {self.out_f_name} res={self.res_w}x{self.res_h}, quality={self.quality}, fps={self.fps}, color={self.color} (step {step_lower}-{step_current}-{step_upper})')
-            
-            self.frames_processed = self.frames_drop(self.frames_raw)
-            self.frames_processed = self.frames_resize(self.frames_processed)
-            self.frames_export()
-
-            self.tmp_f.seek(0)
-            size = self.tmp_f.getbuffer().nbytes
-            if CodecInfo.is_anim(self.in_f):
-                size_max = self.size_max_vid
-            else:
-                size_max = self.size_max_img
-            
-            if not size_max or size < size_max:
-                self.tmp_fs[step_current] = self.tmp_f.read()
 
-                for i in range(self.steps+1):
-                    if self.tmp_fs[i] != None:
-                        self.tmp_fs[min(i+2,self.steps+1):] = [None] * (self.steps+1 - min(i+2,self.steps+1))
-                        break
-            
-            if not size_max:
-                with open(self.out_f, 'wb+') as f:
-                    f.write(self.tmp_fs[step_current])
-                self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step {step_current})')
+        self.size_limited = bool(size_max)
+        if not size_max:
+            # No limit to size, create the best quality result
+            self.write_out_f(self.frames_encode(0, 'best' if self.fast_search else 'normal')[1])
+            self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step 0)')
+            return True
+
+        # Step 0 is the best quality, step self.steps is the smallest size
+        # With fast_search, steps are tried with fast encoder settings and sizes
+        # are scaled by factor to estimate size of best effort encode
+        self.sizes = {}
+        self.results = {}
+        self.encodes = 0
+
+        if self.out_f_ext == '.webm':
+            # VP9 rate control can aim at the size limit directly,
+            # the step search is only needed if that does not work out
+            result = self.search_bitrate(size_max)
+            if result != None:
+                self.write_out_f(result)
+                self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step 0 with target bitrate, {self.encodes} encodes)')
                 return True
 
-            if size < size_max:
-                if step_upper - step_lower > 1:
-                    step_upper = step_current
-                    step_current = int((step_lower + step_upper) / 2)
-                    self.cb_msg(f'[<] Compressed {self.in_f_name} -> {self.out_f_name} but size {size} < limit {size_max}, recompressing')
-                else:
-                    with open(self.out_f, 'wb+') as f:
-                        f.write(self.tmp_fs[step_current])
-                    self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step {step_current})')
-                    return True
+        if self.fast_search:
+            factor = StickerConvert.EFFORT_FACTOR.get(self.out_f_ext, 1)
+        else:
+            factor = 1
+        step_ok, result = self.search_step(-1, self.steps + 1, size_max, factor)
+
+        while result != None and self.fast_search:
+            # Encode the chosen step again with best settings
+            self.size_abort = size_max
+            _, result = self.frames_encode(step_ok, 'best')
+            self.encodes += 1
+            if result == None:
+                # Stopped early, so the ratio is unknown
+                self.cb_msg(f'[>] Compressed {self.in_f_name} -> {self.out_f_name} with best settings but size > limit {size_max}, recompressing')
+                step_ok, result = self.search_step(step_ok, self.steps + 1, size_max, factor * StickerConvert.ABORT_PROJECTION_MARGIN)
+                continue
+
+            ratio = len(result) / self.results[step_ok][0]
+
+            if len(result) < size_max:
+                break
+
+            # Estimate was too optimistic, search again above this step
+            # with sizes scaled by the ratio seen on this file
+            self.cb_msg(f'[>] Compressed {self.in_f_name} -> {self.out_f_name} with best settings but size {len(result)} > limit {size_max}, recompressing')
+            step_ok, result = self.search_step(step_ok, self.steps + 1, size_max, ratio)
+
+        if result != None:
+            self.write_out_f(result)
+            self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step {step_ok}, {self.encodes} encodes)')
+            return True
+        else:
+            self.cb_msg(f'[F] Failed Compression {self.in_f_name} -> {self.out_f_name}, cannot get below limit {size_max} with lowest quality under current settings ({self.encodes} encodes)')
+            return False
+
+    def search_bitrate(self, size_max):
+        # Encode step 0 at a target size derived from size_max
+        # Return the largest result that fits, or None
+        result = None
+        self.size_abort = size_max
+        self.size_target = size_max * StickerConvert.BITRATE_TARGET_RATIO
+
+        for i in range(StickerConvert.BITRATE_TRIES):
+            size, data = self.frames_encode(0)
+            self.encodes += 1
+
+            if data != None and size < size_max:
+                # A later try only has a higher target, so its result is better if it fits
+                result = data
+                if size >= size_max * StickerConvert.BITRATE_FILL_MIN:
+                    break
+                # Less than the bitrate allowed was used, so a higher bitrate would not fill more
+                if size < self.size_target * StickerConvert.BITRATE_FILL_MIN:
+                    break
+                sign = '<'
+            elif result != None:
+                break
             else:
-                if step_upper - step_lower > 1:
-                    step_lower = step_current
-                    step_current = round((step_lower + step_upper) / 2)
-                    self.cb_msg(f'[>] Compressed {self.in_f_name} -> {self.out_f_name} but size {size} > limit {size_max}, recompressing')
+                sign = '>'
+
+            if i < StickerConvert.BITRATE_TRIES - 1:
+                self.cb_msg(f'[{sign}] Compressed {self.in_f_name} -> {self.out_f_name} but size {size} {sign} limit {size_max}, recompressing with scaled bitrate')
+            self.size_target *= min(size_max * StickerConvert.BITRATE_TARGET_RATIO / size, StickerConvert.BITRATE_SCALE_MAX)
+
+        self.size_target = None
+        return result
+
+    def search_step(self, step_fail, step_ok, size_max, factor):
+        # Search for the lowest step that fits, within (step_fail, step_ok)
+        # Results of previous searches are reused, scaled by factor
+        effort = 'fast' if self.fast_search else 'normal'
+        result = None
+        # Encodes are stopped once they are sure to not fit
+        self.size_abort = size_max / factor
+
+        steps_current = sorted(self.results)
+        results = [self.results[i] for i in steps_current]
+        steps_current_new = []
+        self.sizes = {}
+
+        while True:
+            for step_current, (size_raw, data) in sorted(zip(steps_current, results), key=lambda i: i[0]):
+                size = round(size_raw * factor)
+                self.sizes[step_current] = size
+                self.results[step_current] = (size_raw, data)
+
+                # Results of a higher step that contradict a lower step are ignored
+                if size < size_max and step_fail < step_current < step_ok:
+                    step_ok = step_current
+                    result = data
+                    sign = '<'
+                elif size >= size_max and step_fail < step_current < step_ok:
+                    step_fail = step_current
+                    sign = '>'
                 else:
-                    if step_current < self.steps:
-                        with open(self.out_f, 'wb+') as f:
-                            f.write(self.tmp_fs[step_current + 1])
-                        self.cb_msg(f'[S] Successful compression {self.in_f_name} -> {self.out_f_name} (step {step_current})')
-                        return True
-                    else:
-                        self.cb_msg(f'[F] Failed Compression {self.in_f_name} -> {self.out_f_name}, cannot get below limit {size_max} with lowest quality under current settings')
-                        return False
-    
-    def frames_import(self):
-        if self.in_f_ext in ('.tgs', '.lottie', '.json'):
-            self.frames_import_lottie()
+                    continue
+
+                if step_ok - step_fail > 1 and step_current in steps_current_new:
+                    self.cb_msg(f'[{sign}] Compressed {self.in_f_name} -> {self.out_f_name} but size {size} {sign} limit {size_max}, recompressing')
+
+            if step_ok - step_fail <= 1:
+                return step_ok, result
+
+            steps_current = self.get_steps_next(step_fail, step_ok, size_max)
+            steps_current_new = steps_current
+            results = self.frames_encode_parallel(steps_current, effort)
+            self.encodes += len(steps_current)
+
+    def get_steps_next(self, step_fail, step_ok, size_max):
+        steps_count = min(self.parallel_steps, step_ok - step_fail - 1)
+
+        if steps_count > 1 and (self.search != 'predict' or len(self.sizes) == 0):
+            # Split the bracket evenly
+            return sorted({step_fail + round((i + 1) * (step_ok - step_fail) / (steps_count + 1)) for i in range(steps_count)})
+
+        # Try neighbours of the predicted step too, as the search
+        # ends once a step fits and the step before it does not
+        step_next = self.get_step_next(step_fail, step_ok, size_max)
+        steps_next = [step_next]
+        offset = 1
+        while len(steps_next) < steps_count:
+            for step in (step_next - offset, step_next + offset):
+                if step_fail < step < step_ok and len(steps_next) < steps_count:
+                    steps_next.append(step)
+            offset += 1
+
+        return steps_next
+
+    def get_step_next(self, step_fail, step_ok, size_max):
+        step_bisect = (step_fail + step_ok + 1) // 2
+
+        if self.search != 'predict' or len(self.sizes) == 0:
+            return step_bisect
+
+        if len(self.sizes) == 1:
+            # Assume size is proportional to number of pixels per second
+            step_a, size_a = next(iter(self.sizes.items()))
+            cost_a = self.get_step_cost(step_a)
+            for step in range(step_fail + 1, step_ok):
+                if size_a * self.get_step_cost(step) / cost_a < size_max:
+                    return step
+            return step_ok - 1 if self.get_step_cost(step_ok - 1) != cost_a else step_bisect
+
+        # Interpolation on log(size) between nearest steps on each side of the limit,
+        # or extrapolation from the two nearest steps on the same side
+        if step_fail in self.sizes and step_ok in self.sizes:
+            (step_a, size_a), (step_b, size_b) = (step_fail, self.sizes[step_fail]), (step_ok, self.sizes[step_ok])
         else:
-            self.frames_import_imageio()
-
-    def frames_import_imageio(self):
-        if self.in_f_ext == '.webp':
-            # ffmpeg do not support webp decoding (yet)
-            for frame in iio.imiter(self.in_f, plugin='pillow', mode='RGBA'):
-                self.frames_raw.append(frame)
+            step_known = step_fail if step_fail in self.sizes else step_ok
+            step_nearest = sorted(self.sizes, key=lambda i: abs(i - step_known))[:2]
+            (step_a, size_a), (step_b, size_b) = ((i, self.sizes[i]) for i in sorted(step_nearest))
+
+        slope = (math.log(size_b) - math.log(size_a)) / (step_b - step_a)
+        if slope >= 0:
+            # Size does not decrease with step, prediction is meaningless
+            return step_bisect
+
+        step_predict = step_a + (math.log(size_max) - math.log(size_a)) / slope
+
+        # The lowest step that fits is predicted to be ceil(step_predict)
+        # Alternate to bisection if last two predictions landed on the same side,
+        # so that the bracket keeps shrinking from both sides
+        steps_measured = list(self.sizes)
+        if len(steps_measured) >= 3:
+            last_sides = [self.sizes[i] < size_max for i in steps_measured[-2:]]
+            if last_sides[0] == last_sides[1] and steps_measured[-1] not in (step_fail + 1, step_ok - 1):
+                return step_bisect
+
+        return min(max(math.ceil(step_predict), step_fail + 1), step_ok - 1)
+
+    def write_out_f(self, data):
+        with open(self.out_f, 'wb+') as f:
+            f.write(data)
+
+        if self.conversion_cache:
+            self.conversion_cache.put(self.conversion_cache_key, data)
+
+    def get_step_cost(self, step):
+        res_w, res_h, _, fps, _ = self.steps_list[step]
+        res_w = res_w if res_w else self.in_f_info.width
+        res_h = res_h if res_h else self.in_f_info.height
+        if self.in_f_info.anim:
+            fps = min(fps, self.in_f_info.fps) if fps else self.in_f_info.fps
         else:
-            for frame in iio.imiter(self.in_f, plugin='pyav', format='rgba'):
-                self.frames_raw.append(frame)
+            fps = 1
+        return res_w * res_h * fps
+
+    def frames_encode(self, step, effort='normal'):
+        self.res_w, self.res_h, self.quality, self.fps, self.color = self.steps_list[step]
+        self.effort = effort
+
+        self.tmp_f = io.BytesIO()
+        target = f', target size={round(self.size_target)}' if self.size_target else ''
+        self.cb_msg(f'[C] Compressing {self.in_f_name} -> {self.out_f_name} res={self.res_w}x{self.res_h}, quality={self.quality}, fps={self.fps}, color={self.color}{target} (step {step})')
+
+        self.frames_processed = self.frames_process()
+        if self.out_f_ext in ('.apng', '.webp', '.gif') and not self.static:
+            self.frames_processed = self.frames_processed.dedup(self.fps)
+        self.size_aborted = None
+        self.frames_export()
+
+        # Size of stopped encode is projected from frames encoded so far
+        if self.size_aborted != None:
+            return self.size_aborted, None
+        data = self.tmp_f.getvalue()
+        return len(data), data
+
+    def check_size_abort(self, size, frames_done):
+        if self.size_abort == None:
+            return False
+
+        size_projected = size * len(self.frames_processed) / frames_done
+        if (size >= self.size_abort or
+            (frames_done >= len(self.frames_processed) / 2 and
+             size_projected >= self.size_abort * StickerConvert.ABORT_PROJECTION_MARGIN)):
+            self.size_aborted = max(round(size_projected), size)
+            self.cb_msg(f'[>] Stopped compressing {self.in_f_name} -> {self.out_f_name} after {frames_done} of {len(self.frames_processed)} frames, size {self.size_aborted} > limit')
+            return True
+
+        return False
+
+    def frames_process(self):
+        # Steps that only differ in quality or color reuse the same frames,
+        # and a still is only resized once per resolution
+        key = (None if self.static else self.fps, self.res_w, self.res_h)
+        with self.frames_processed_cache_lock:
+            frames = self.frames_processed_cache.get(key)
+            if frames != None:
+                self.frames_processed_cache.move_to_end(key)
+
+        if frames == None and self.static:
+            frames = self.frames_resize(self.frames_raw, [0])
+            self.frames_processed_cache_put(key, frames)
+        elif frames == None:
+            frames = self.frames_resize(self.frames_raw, self.frames_drop())
+            self.frames_processed_cache_put(key, frames)
+
+        self.res_h, self.res_w = frames.height, frames.width
+        return frames
+
+    def frames_processed_cache_put(self, key, frames):
+        if frames.nbytes > StickerConvert.FRAMES_PROCESSED_CACHE_MAX:
+            return
+
+        with self.frames_processed_cache_lock:
+            self.frames_processed_cache[key] = frames
+            size_total = sum(i.nbytes for i in self.frames_processed_cache.values())
+            while size_total > StickerConvert.FRAMES_PROCESSED_CACHE_MAX:
+                _, frames_evicted = self.frames_processed_cache.popitem(last=False)
+                size_total -= frames_evicted.nbytes
+
+    def frames_encode_parallel(self, steps, effort='normal'):
+        if len(steps) == 1:
+            return [self.frames_encode(steps[0], effort)]
+
+        def frames_encode_worker(step):
+            # Each step is encoded by its own copy, which shares the decoded frames
+            return copy.copy(self).frames_encode(step, effort)
+
+        with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+            return list(executor.map(frames_encode_worker, steps))
+
+    def frames_import(self):
+        # Decode no larger than the step with highest resolution
+        self.decode_res = self.get_decode_res(*self.steps_list[0][:2])
 
-    def frames_import_lottie(self):
-        if self.in_f_ext == '.tgs':
-            anim = LottieAnimation.from_tgs(self.in_f)
+        if self.static:
+            # Pillow opens a still image without setting up a codec
+            frames_wanted = {0}
+            _, decode = DecoderRegistry.get_decoder(self.in_f_ext, 'pillow')
         else:
-            anim = LottieAnimation.from_file(self.in_f)
+            # Only frames used by the step with highest fps are kept,
+            # lower fps steps pick the nearest kept frame
+            fps_max = max((i[3] for i in self.steps_list if i[3]), default=None)
+            frames_wanted = set(self.get_frames_wanted(self.get_extraction_fps(fps_max), self.in_f_info.frames))
 
-        for i in range(anim.lottie_animation_get_totalframe()):
-            frame = np.asarray(anim.render_pillow_frame(frame_num=i))
-            self.frames_raw.append(frame)
-        
-        LottieAnimation.lottie_shutdown()
+            if self.in_f_ext in ('.tgs', '.lottie', '.json'):
+                self.frames_raw = self.frames_import_lottie(frames_wanted)
+                return
 
-    def frames_resize(self, frames_in):
-        frames_out = []
+            _, decode = DecoderRegistry.get_decoder(self.in_f_ext)
 
-        for frame in frames_in:
-            im = Image.fromarray(frame, 'RGBA')
-            width, height = im.size
+        def frames_indexed():
+            for index, frame in decode(self, frames_wanted):
+                self.frames_raw_index.append(index)
+                yield frame
 
-            if self.res_w == None:
-                self.res_w = width
-            if self.res_h == None:
-                self.res_h = height
+        self.frames_raw = FrameStack.from_iter(frames_indexed(), len(frames_wanted), *self.decode_res)
 
-            if width > height:
-                width_new = self.res_w
-                height_new = height * self.res_w // width
-            else:
-                height_new = self.res_h
-                width_new = width * self.res_h // height
-            im = im.resize((width_new, height_new), resample=Image.LANCZOS)
-            im_new = Image.new('RGBA', (self.res_w, self.res_h), (0, 0, 0, 0))
-            im_new.paste(im, ((self.res_w - width_new) // 2, (self.res_h - height_new) // 2))
-            frames_out.append(np.asarray(im_new))
+    def frames_keep(self, index, frames_wanted):
+        # Decoders pass every frame here, so frames not kept are counted too
+        self.frames_raw_count = max(self.frames_raw_count, index + 1)
+        # Keep everything beyond frame count in header, in case it was wrong
+        return index in frames_wanted or index >= self.in_f_info.frames
+
+    def get_decode_res(self, res_w, res_h):
+        width, height = self.in_f_info.res
+
+        if res_w == None or res_h == None:
+            return width, height
+
+        # Same fitting as frames_resize, so no resize is needed for that step
+        if width > height:
+            width_new = res_w
+            height_new = height * res_w // width
+        else:
+            height_new = res_h
+            width_new = width * res_h // height
+
+        # Never upscale while decoding
+        if width_new >= width or height_new >= height:
+            return width, height
+        return width_new, height_new
+
+    def frames_import_pillow(self, frames_wanted):
+        with Image.open(self.in_f) as im:
+            # JPEG can be decoded at reduced scale directly
+            im.draft(None, self.decode_res)
+
+            for index in range(getattr(im, 'n_frames', 1)):
+                if self.frames_keep(index, frames_wanted):
+                    im.seek(index)
+                    yield index, self.frame_fit_decode_res(im.convert('RGBA'))
+
+    def frames_import_libwebp(self, frames_wanted):
+        with open(self.in_f, 'rb') as f:
+            data = webp.WebPData.from_buffer(f.read())
+        options = webp.WebPAnimDecoderOptions.new(use_threads=self.threads != 1)
+        dec = webp.WebPAnimDecoder.new(data, options)
+
+        # Every frame is decoded, as frames are composed on previous frames
+        for index, (frame, _) in enumerate(dec.frames()):
+            if self.frames_keep(index, frames_wanted):
+                yield index, self.frame_fit_decode_res(Image.fromarray(frame, 'RGBA'))
+
+    def frames_import_pyav(self, frames_wanted):
+        width, height = self.decode_res
+        with av.open(self.in_f) as container:
+            stream = container.streams.video[0]
+            # Frame and slice threads within the cores left for this process
+            stream.thread_type = 'AUTO'
+            if self.threads:
+                stream.codec_context.thread_count = self.threads
+            for index, frame in enumerate(container.decode(stream)):
+                if self.frames_keep(index, frames_wanted):
+                    yield index, frame.to_ndarray(width=width, height=height, format='rgba', interpolation='LANCZOS')
+
+    def frame_fit_decode_res(self, frame):
+        if frame.size != self.decode_res:
+            frame = frame.resize(self.decode_res, resample=Image.LANCZOS, reducing_gap=3.0)
+        return np.asarray(frame)
+
+    def frames_import_lottie(self, frames_wanted):
+        width, height = self.decode_res
+        frames_num = sorted(frames_wanted)
+        frames = LottieRenderer.render_parallel(self.in_f, width, height, frames_num, self.threads or 1)
+        self.frames_raw_index = frames_num
+        # Total frames of the animation (op - ip), the last frame wanted may come before its end
+        self.frames_raw_count = self.in_f_info.frames
+        return FrameStack(frames)
+
+    def frames_resize(self, frames_in, indices):
+        # Resize frames_in[i] for i in indices into one stack
+        width, height = frames_in.width, frames_in.height
+
+        if self.res_w == None:
+            self.res_w = width
+        if self.res_h == None:
+            self.res_h = height
+
+        if width > height:
+            width_new = self.res_w
+            height_new = height * self.res_w // width
+        else:
+            height_new = self.res_h
+            width_new = width * self.res_h // height
+        # Frame is centered, and cropped if it is larger than the canvas
+        x = (self.res_w - width_new) // 2
+        y = (self.res_h - height_new) // 2
+        crop_x, crop_y = max(0, -x), max(0, -y)
+        x, y = max(0, x), max(0, y)
+        area_w = min(width_new - crop_x, self.res_w - x)
+        area_h = min(height_new - crop_y, self.res_h - y)
+
+        # Borders are cleared for all frames at once, then each
+        # frame is scaled straight into the area between them
+        frames_out = FrameStack.empty(len(indices), self.res_w, self.res_h)
+        frames_out.frames[:, :y] = 0
+        frames_out.frames[:, y + area_h:] = 0
+        frames_out.frames[:, y:y + area_h, :x] = 0
+        frames_out.frames[:, y:y + area_h, x + area_w:] = 0
+        area = frames_out.frames[:, y:y + area_h, x:x + area_w]
+
+        if (width_new, height_new) == (width, height):
+            area[:] = frames_in.frames[indices, crop_y:crop_y + area_h, crop_x:crop_x + area_w]
+            return frames_out
+
+        for i, index in enumerate(indices):
+            if i > 0 and index == indices[i - 1]:
+                # Repeated frame when fps goes up
+                area[i] = area[i - 1]
+                continue
+            im = Image.fromarray(frames_in[index], 'RGBA')
+            frame = np.asarray(im.resize((width_new, height_new), resample=Image.LANCZOS))
+            area[i] = frame[crop_y:crop_y + area_h, crop_x:crop_x + area_w]
         
         return frames_out
     
-    def frames_drop(self, frames_in):
-        frames_out = []
+    def frames_drop(self):
+        # Return position in frames_raw of each frame at the step fps
+        indices = []
 
-        if not (self.duration_min or self.duration_max):
-            return frames_in
-        
-        frames_orig = CodecInfo.get_file_frames(self.in_f)
-        fps_orig = CodecInfo.get_file_fps(self.in_f)
-        duration_orig = frames_orig / fps_orig * 1000
+        extraction_fps = self.get_extraction_fps(self.fps)
+        for index in self.get_frames_wanted(extraction_fps, self.frames_raw_count):
+            # Nearest kept frame at or before the wanted frame
+            indices.append(bisect.bisect_right(self.frames_raw_index, index) - 1)
+
+        return indices
+
+    def get_extraction_fps(self, fps):
+        fps_orig = self.in_f_info.fps
+        duration_orig = self.in_f_info.duration
+
+        if not fps:
+            fps = fps_orig
 
         if self.duration_min and self.duration_min > 0 and duration_orig < self.duration_min:
-            extraction_fps = self.duration_min / duration_orig * self.fps
+            extraction_fps = self.duration_min / duration_orig * fps
         elif self.duration_max and self.duration_max > 0 and duration_orig > self.duration_max:
-            extraction_fps = self.duration_max / duration_orig * self.fps
+            extraction_fps = self.duration_max / duration_orig * fps
         else:
-            extraction_fps = self.fps
+            extraction_fps = fps
 
         if extraction_fps < 1:
             extraction_fps = 1 / math.ceil(1 / extraction_fps)
         else:
             extraction_fps = math.ceil(extraction_fps)
 
+        return extraction_fps
+
+    def get_frames_wanted(self, extraction_fps, frames_count):
+        frames_wanted = []
+
         frame_current = 0
-        while frame_current < len(frames_in):
-            frames_out.append(frames_in[int(frame_current)])
-            frame_current += fps_orig / extraction_fps
+        while frame_current < frames_count:
+            frames_wanted.append(int(frame_current))
+            frame_current += self.in_f_info.fps / extraction_fps
 
-        return frames_out
+        return frames_wanted
 
     def frames_export(self):
-        if self.out_f_ext == '.apng':
-            self.frames_export_apng()
-        elif self.out_f_ext == '.png':
-            self.frames_export_png()
-        elif self.out_f_ext == '.webp':
-            self.frames_export_webp()
-        else:
-            self.frames_export_imageio()
+        _, export = EncoderRegistry.get_encoder(self.out_f_ext, self.encoder, self.size_limited)
+        export(self)
 
     def frames_export_imageio(self):
         options = {
@@ -280,32 +711,110 @@ class StickerConvert:
             codec = 'apng'
             pixel_format = 'rgba'
             options['plays'] = '0'
+            options['pred'] = 'mixed'
         else:
             codec = 'vp9'
             pixel_format = 'yuva420p'
             options['loop'] = '0'
+            # 'quality' is an alias of 'deadline' in libvpx. The deadline it
+            # gives already encodes smaller than 'good', even at cpu-used 1
+            if self.size_target != None:
+                # Rate control decides quality to land on the target size
+                del options['quality']
+                options['deadline'] = 'good'
+                options['cpu-used'] = '4'
+                options['row-mt'] = '1'
+                options['tile-columns'] = str(int(math.log2(max(1, self.res_w // 256))))
+                bit_rate = round(self.size_target * 8 * self.fps / len(self.frames_processed))
+            elif self.effort == 'fast':
+                del options['quality']
+                options['deadline'] = 'realtime'
+                options['cpu-used'] = '8'
         
         with av.open(self.tmp_f, 'w', format=self.out_f_ext.replace('.', '')) as output:
             out_stream = output.add_stream(codec, rate=self.fps, options=options)
             out_stream.width = self.res_w
             out_stream.height = self.res_h
             out_stream.pix_fmt = pixel_format
+            if codec == 'vp9' and self.size_target != None:
+                out_stream.bit_rate = bit_rate
             
-            for frame in self.frames_processed:
-                av_frame = av.VideoFrame.from_ndarray(frame, format='rgba')
+            # Muxer may hold back whole clusters and encoder may hold back frames,
+            # so count size and number of packets out of encoder instead
+            size = 0
+            packets = 0
+            # GIF and APNG frames have their own duration, timestamps are in miliseconds
+            if codec in ('gif', 'apng'):
+                out_stream.codec_context.time_base = Fraction(1, 1000)
+                timestamps = np.cumsum([0] + self.frames_processed.durations[:-1]).tolist()
+                durations = dict(zip(timestamps, self.frames_processed.durations))
+
+            if codec == 'vp9':
+                # Encodes running in parallel share the cores of this process
+                if self.threads:
+                    threads = self.threads if self.size_target != None else self.threads // self.parallel_steps
+                    out_stream.codec_context.thread_count = max(1, threads)
+                frames = self.get_frames_yuva()
+            elif codec == 'apng':
+                frames = self.frames_quantized()
+            else:
+                frames = self.frames_processed
+
+            for i, frame in enumerate(frames):
+                if codec == 'vp9':
+                    av_frame = frame
+                    av_frame.pts = i
+                else:
+                    av_frame = av.VideoFrame.from_ndarray(frame, format='rgba')
+                if codec in ('gif', 'apng'):
+                    av_frame.pts = timestamps[i]
+                    av_frame.time_base = Fraction(1, 1000)
                 for packet in out_stream.encode(av_frame):
+                    if codec in ('gif', 'apng'):
+                        packet.duration = durations[packet.pts]
+                    size += packet.size
+                    packets += 1
                     output.mux(packet)
+                if packets > 0 and self.check_size_abort(size, packets):
+                    return
             
             for packet in out_stream.encode():
                 output.mux(packet)
     
+    def get_frames_yuva(self):
+        # Processed frames are converted once and reused by later encodes of
+        # the same frames, such as retries at another bitrate
+        key = (self.fps, self.res_w, self.res_h)
+        with self.frames_processed_cache_lock:
+            if key in self.frames_yuva_cache:
+                return self.frames_yuva_cache[key]
+
+        reformatter = VideoReformatter()
+        frames = [reformatter.reformat(av.VideoFrame.from_ndarray(frame, format='rgba'), format='yuva420p')
+                  for frame in self.frames_processed]
+
+        with self.frames_processed_cache_lock:
+            self.frames_yuva_cache.clear()
+            self.frames_yuva_cache[key] = frames
+        return frames
+
     def frames_export_webp(self):
+        if self.static:
+            # Plain lossy WebP without animation chunks, quality is searched like other steps
+            method = {'fast': 0, 'normal': 4, 'best': 6}[self.effort]
+            config = webp.WebPConfig.new(quality=self.quality, method=method)
+            pic = webp.WebPPicture.from_numpy(self.frames_processed[0])
+            self.tmp_f.write(pic.encode(config).buffer())
+            return
+
         enc = webp.WebPAnimEncoder.new(self.res_w, self.res_h)
+        # Method above 4 is several times slower for no gain on animations
+        config = webp.WebPConfig.new(method=0 if self.effort == 'fast' else 4)
         timestamp_ms = 0
-        for frame in self.frames_processed:
+        for frame, duration in zip(self.frames_processed, self.frames_processed.durations):
             pic = webp.WebPPicture.from_numpy(frame)
-            enc.encode_frame(pic, timestamp_ms)
-            timestamp_ms += int(1 / self.fps * 1000)
+            enc.encode_frame(pic, timestamp_ms, config)
+            timestamp_ms += duration
         anim_data = enc.assemble(timestamp_ms)
         self.tmp_f.write(anim_data.buffer())
 
@@ -318,32 +827,108 @@ class StickerConvert:
         with io.BytesIO() as f:
             image_quant.save(f, format='png')
             f.seek(0)
-            frame_optimized = oxipng.optimize_from_memory(f.read(), level=4)
+            level = {'fast': 1, 'normal': 4, 'best': 6}[self.effort]
+            frame_optimized = oxipng.optimize_from_memory(f.read(), level=level)
             self.tmp_f.write(frame_optimized)
 
     def frames_export_apng(self):
-        frames_concat = np.concatenate(self.frames_processed)
-        image_concat = Image.fromarray(frames_concat, 'RGBA')
+        colors = None
+        alpha = True
         if self.color and self.color < 256:
-            image_quant = image_concat.quantize(colors=self.color, method=2)
+            quantizer = self.get_palette_quantizer()
+            palette = quantizer.palette
+        else:
+            # Without quantizing, frames are stored in the smallest color
+            # type that keeps them lossless, as oxipng did
+            quantizer = None
+            colors = ApngWriter.get_colors(self.frames_processed.frames)
+            if colors is None:
+                palette = None
+                alpha = bool((self.frames_processed.frames[..., 3] != 255).any())
+            else:
+                palette = colors.view(np.uint8).reshape(-1, 4)
+
+        compress_level = 6 if self.effort == 'fast' else 9
+        apng = ApngWriter(self.res_w, self.res_h, palette=palette, alpha=alpha, compress_level=compress_level)
+        for i, (frame, duration) in enumerate(zip(self.frames_processed, self.frames_processed.durations)):
+            if quantizer:
+                frame = quantizer.quantize(frame)
+            elif colors is not None:
+                frame = ApngWriter.index_colors(frame, colors)
+            apng.add_frame(frame, duration, 1000)
+            if self.check_size_abort(apng.size, i + 1):
+                return
+        self.tmp_f.write(apng.get_data())
+
+    def frames_export_apng_pillow(self):
+        if self.color and self.color < 256:
+            quantizer = self.get_palette_quantizer()
+            images = []
+            for frame in self.frames_processed:
+                image = Image.fromarray(quantizer.quantize(frame), 'P')
+                image.putpalette(quantizer.palette.tobytes(), rawmode='RGBA')
+                images.append(image)
         else:
-            image_quant = image_concat
-
-        for i in range(0, image_quant.height, self.res_h):
-            with io.BytesIO() as f:
-                image_quant.crop((0, i, image_quant.width, i+self.res_h)).save(f, format='png')
-                f.seek(0)
-                frame_optimized = oxipng.optimize_from_memory(f.read(), level=4)
-            image_final = Image.open(io.BytesIO(frame_optimized)).convert('RGBA')
-            frame_final = create_frame_from_rgba(np.array(image_final).flatten(), image_final.width, image_final.height)
-            frame_final.delay_num = int(1000 / self.fps)
+            images = [Image.fromarray(frame, 'RGBA') for frame in self.frames_processed]
+
+        compress_level = 6 if self.effort == 'fast' else 9
+        images[0].save(self.tmp_f, format='png', save_all=True, append_images=images[1:],
+                       duration=self.frames_processed.durations, loop=0, disposal=0, blend=0,
+                       compress_level=compress_level)
+
+    def frames_export_apng_apngasm(self):
+        apngasm = APNGAsm()
+        for frame, duration in zip(self.frames_quantized(), self.frames_processed.durations):
+            frame_final = create_frame_from_rgba(frame.flatten(), self.res_w, self.res_h)
+            frame_final.delay_num = duration
             frame_final.delay_den = 1000
-            self.apngasm.add_frame(frame_final)
+            apngasm.add_frame(frame_final)
 
         with CacheStore.get_cache_store(path=self.cache_dir) as tempdir:
-            self.apngasm.assemble(os.path.join(tempdir, 'out.apng'))
+            apngasm.assemble(os.path.join(tempdir, 'out.apng'))
 
             with open(os.path.join(tempdir, 'out.apng'), 'rb') as f:
                 self.tmp_f.write(f.read())
 
-        self.apngasm.reset()
\ No newline at end of file
+    def frames_quantized(self):
+        # Frames reduced to the palette, for encoders that only take RGBA
+        if not (self.color and self.color < 256):
+            return self.frames_processed
+
+        quantizer = self.get_palette_quantizer()
+        return (quantizer.palette[quantizer.quantize(frame)] for frame in self.frames_processed)
+
+    def get_palette_quantizer(self):
+        # Palette is built from a sample of frames once per color value,
+        # and reused when other steps try the same color value
+        quantizer = self.palette_cache.get(self.color)
+        if quantizer == None:
+            quantizer = PaletteQuantizer.from_frames(self.frames_processed.frames, self.color)
+            self.palette_cache[self.color] = quantizer
+        return quantizer
+
+# Profiles are measured on sample APNG, GIF, WebP, MP4 and TGS stickers
+# at two steps of the line preset
+EncoderRegistry.register('.apng', 'apng_writer', StickerConvert.frames_export_apng, speed=3.5, ratio=1.07)
+EncoderRegistry.register('.apng', 'apngasm', StickerConvert.frames_export_apng_apngasm, speed=2.0, ratio=1.03)
+EncoderRegistry.register('.apng', 'pillow', StickerConvert.frames_export_apng_pillow, speed=15.7, ratio=1.24)
+EncoderRegistry.register('.apng', 'pyav', StickerConvert.frames_export_imageio, speed=2.0, ratio=1.6)
+EncoderRegistry.register('.png', 'oxipng', StickerConvert.frames_export_png, speed=1, ratio=1)
+EncoderRegistry.register('.webp', 'webp', StickerConvert.frames_export_webp, speed=1, ratio=1)
+EncoderRegistry.register('.gif', 'pyav', StickerConvert.frames_export_imageio, speed=1, ratio=1)
+EncoderRegistry.register('.webm', 'pyav', StickerConvert.frames_export_imageio, speed=1, ratio=1)
+EncoderRegistry.register(None, 'pyav', StickerConvert.frames_export_imageio, speed=1, ratio=1)
+
+# Speed is measured decoding sample animated WebP, GIF and APNG stickers
+# ffmpeg do not support webp decoding (yet), and JPEG is decoded at reduced scale by Pillow
+DecoderRegistry.register('.webp', 'libwebp', StickerConvert.frames_import_libwebp, speed=117)
+DecoderRegistry.register('.webp', 'pillow', StickerConvert.frames_import_pillow, speed=49)
+DecoderRegistry.register('.gif', 'pyav', StickerConvert.frames_import_pyav, speed=117)
+DecoderRegistry.register('.gif', 'pillow', StickerConvert.frames_import_pillow, speed=84)
+DecoderRegistry.register('.png', 'pyav', StickerConvert.frames_import_pyav, speed=76)
+DecoderRegistry.register('.png', 'pillow', StickerConvert.frames_import_pillow, speed=44)
+DecoderRegistry.register('.apng', 'pyav', StickerConvert.frames_import_pyav, speed=76)
+DecoderRegistry.register('.apng', 'pillow', StickerConvert.frames_import_pillow, speed=44)
+DecoderRegistry.register('.jpg', 'pillow', StickerConvert.frames_import_pillow, speed=1)
+DecoderRegistry.register('.jpeg', 'pillow', StickerConvert.frames_import_pillow, speed=1)
+DecoderRegistry.register(None, 'pyav', StickerConvert.frames_import_pyav, speed=1)
\ No newline at end of file
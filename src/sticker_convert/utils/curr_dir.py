@@ -66,4 +66,16 @@ class CurrDir:
             return creds_dir
         else:
             os.makedirs(fallback_dir, exist_ok=True)
-            return fallback_dir
\ No newline at end of file
+            return fallback_dir
+    
+    @staticmethod
+    def get_cache_dir():
+        if sys.platform == 'win32':
+            cache_dir = os.path.expandvars('%LOCALAPPDATA%\\sticker-convert\\cache')
+        elif sys.platform == 'darwin':
+            cache_dir = os.path.expanduser('~/Library/Caches/sticker-convert')
+        else:
+            cache_dir = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'sticker-convert')
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
\ No newline at end of file
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+class DecoderRegistry:
+    '''
+    Decoders available for each input format, and their speed in megapixels
+    per second when decoding every frame, measured on sample stickers.
+
+    decode is called with the StickerConvert doing the import and the set of
+    frame indices wanted, and yields (index, frame) at StickerConvert.decode_res.
+    Decoders registered for ext None are used for formats without their own.
+    '''
+    decoders = {}
+
+    @staticmethod
+    def register(ext, name, decode, speed):
+        DecoderRegistry.decoders.setdefault(ext, {})[name] = {
+            'decode': decode,
+            'speed': speed
+        }
+
+    @staticmethod
+    def get_decoder(ext, name=None):
+        # Return name and decode function of the fastest decoder for ext,
+        # or of the decoder called name if there is one for ext
+        decoders = DecoderRegistry.decoders.get(ext, DecoderRegistry.decoders[None])
+        if name in decoders:
+            return name, decoders[name]['decode']
+        name = max(decoders, key=lambda i: decoders[i]['speed'])
+        return name, decoders[name]['decode']
\ No newline at end of file
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+class EncoderRegistry:
+    '''
+    Encoders available for each output format, with a profile of each one.
+
+    export is called with the StickerConvert doing the encode, and writes
+    StickerConvert.frames_processed to StickerConvert.tmp_f.
+    Encoders registered for ext None are used for formats without their own.
+    speed is in megapixels per second, and ratio is size of results relative to the encoder of
+    the same format giving smallest results, measured on sample stickers.
+    '''
+    # When size is limited, an encoder is only chosen for its speed if its
+    # results are at most this much larger than the smallest results
+    RATIO_TOLERANCE = 0.15
+
+    encoders = {}
+
+    @staticmethod
+    def register(ext, name, export, speed, ratio):
+        EncoderRegistry.encoders.setdefault(ext, {})[name] = {
+            'export': export,
+            'speed': speed,
+            'ratio': ratio
+        }
+
+    @staticmethod
+    def get_encoder(ext, name=None, size_limited=True):
+        # Return name and export function of the encoder to use for ext,
+        # which is the encoder called name if there is one for ext
+        encoders = EncoderRegistry.encoders.get(ext, EncoderRegistry.encoders[None])
+        if name in encoders:
+            return name, encoders[name]['export']
+
+        # Without size limit, any encoder gives the same quality
+        candidates = list(encoders)
+        if size_limited:
+            ratio_min = min(i['ratio'] for i in encoders.values())
+            candidates = [i for i in candidates if encoders[i]['ratio'] <= ratio_min * (1 + EncoderRegistry.RATIO_TOLERANCE)]
+
+        name = max(candidates, key=lambda i: encoders[i]['speed'])
+        return name, encoders[name]['export']
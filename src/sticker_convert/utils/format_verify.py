@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 from .codec_info import CodecInfo
+from .media_info import MediaInfo
 from lottie.exporters.tgs_validator import TgsValidator, Severity
 import unicodedata
 import re
@@ -60,7 +61,7 @@ class FormatVerify:
 
     @staticmethod
     def check_file_res(file, res=None, square=None):
-        file_width, file_height = CodecInfo.get_file_res(file)
+        file_width, file_height = MediaInfo.probe(file).res
 
         if res and (res.get('w', {}).get('min') and res.get('w', {}).get('max')) and (file_width < res['w']['min'] or file_width > res['w']['max']):
             return False
@@ -73,7 +74,7 @@ class FormatVerify:
 
     @staticmethod
     def check_file_fps(file, fps):
-        file_fps = CodecInfo.get_file_fps(file)
+        file_fps = MediaInfo.probe(file).fps
 
         if fps and fps.get('min') != None and file_fps < fps['min']:
             return False
@@ -85,7 +86,7 @@ class FormatVerify:
     @staticmethod
     def check_file_size(file, size=None):
         file_size = os.path.getsize(file)
-        file_animated = CodecInfo.is_anim(file)
+        file_animated = MediaInfo.probe(file).anim
 
         if file_animated == True and size and size.get('vid') != None and file_size > size['vid']:
             return False
@@ -96,7 +97,7 @@ class FormatVerify:
     
     @staticmethod
     def check_animated(file, animated=None):
-        if animated != None and CodecInfo.is_anim(file) != animated:
+        if animated != None and MediaInfo.probe(file).anim != animated:
             return False
         
         return True
@@ -113,7 +114,7 @@ class FormatVerify:
         formats = []
         if format != None:
             if type(format) == dict:
-                if FormatVerify.check_animated(file):
+                if MediaInfo.probe(file).anim:
                     format = format.get('vid')
                 else:
                     format = format.get('img')
@@ -134,7 +135,7 @@ class FormatVerify:
     
     @staticmethod
     def check_duration(file, duration=None):
-        file_duration = CodecInfo.get_file_duration(file)
+        file_duration = MediaInfo.probe(file).duration
         if duration and duration.get('min') != None and file_duration < duration['min']:
             return False
         if duration and duration.get('max') != None and file_duration > duration['max']:
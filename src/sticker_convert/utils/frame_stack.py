@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+import numpy as np
+
+class FrameStack:
+    '''
+    RGBA frames of the same size kept in one array of shape
+    (n, height, width, 4), with optional duration of each frame in miliseconds.
+
+    Indexing with an int gives a view of that frame, indexing with a slice
+    gives a FrameStack viewing the same array, and indexing with a list of
+    indices gives a FrameStack with a copy of those frames.
+    '''
+    # Size of frames compared at once in dedup() (In bytes). Larger blocks are
+    # no faster, as comparing is bound by memory bandwidth
+    DEDUP_BLOCK_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, frames, durations=None):
+        self.frames = frames
+        self.durations = durations
+
+    @staticmethod
+    def empty(count, width, height):
+        return FrameStack(np.empty((count, height, width, 4), dtype=np.uint8))
+
+    @staticmethod
+    def from_iter(frames, count, width, height):
+        # Space for count frames is allocated up front, and doubled if more frames come
+        stack = np.empty((max(1, count), height, width, 4), dtype=np.uint8)
+        i = 0
+        for frame in frames:
+            if i == len(stack):
+                stack = np.concatenate((stack, np.empty_like(stack)))
+            stack[i] = frame
+            i += 1
+        return FrameStack(stack[:i])
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.frames[index]
+
+        if self.durations == None:
+            durations = None
+        elif isinstance(index, slice):
+            durations = self.durations[index]
+        else:
+            durations = [self.durations[i] for i in index]
+        return FrameStack(self.frames[index], durations)
+
+    @property
+    def width(self):
+        return self.frames.shape[2]
+
+    @property
+    def height(self):
+        return self.frames.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def dedup(self, fps):
+        '''
+        Merge runs of identical frames into one frame that is shown longer.
+        Return a FrameStack with the first frame of each run and its duration.
+        '''
+        # Each frame is compared to the next, a block of frames at a time
+        pairs = max(0, len(self) - 1)
+        same = np.empty(pairs, dtype=bool)
+        block = max(1, FrameStack.DEDUP_BLOCK_BYTES // self.frames[0].nbytes) if pairs else 1
+        for start in range(0, pairs, block):
+            end = min(start + block, pairs)
+            same[start:end] = (self.frames[start:end] == self.frames[start + 1:end + 1]).reshape(end - start, -1).all(axis=1)
+        starts = np.flatnonzero(np.concatenate(([True], ~same)))
+
+        # Round timestamps instead of durations, so that rounding errors do not add up
+        timestamps = np.round(np.append(starts, len(self)) * 1000 / fps).astype(int)
+        durations = np.diff(timestamps).tolist()
+
+        if len(starts) == len(self):
+            # Nothing to merge, keep viewing the same frames
+            return FrameStack(self.frames, durations)
+        return FrameStack(self.frames[starts], durations)
\ No newline at end of file
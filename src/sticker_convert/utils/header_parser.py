@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+import mmap
+import struct
+
+class HeaderParser:
+    '''
+    Read resolution, frame count, fps, codec and alpha presence of a file
+    by walking its headers and chunk tables only, without decoding pixels.
+
+    parse() returns a dict with keys width, height, frames, fps, codec and
+    alpha, or None if the format is not recognized or the file is malformed.
+    '''
+    # Frame durations are stored in whole miliseconds or coarser units, so fps
+    # with frame duration this close to that of an integer fps is that fps
+    FPS_SNAP_MS = 0.5
+
+    @staticmethod
+    def parse(file):
+        with open(file, 'rb') as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return
+
+        with mm:
+            try:
+                if mm[:8] == b'\x89PNG\r\n\x1a\n':
+                    return HeaderParser.parse_png(mm)
+                elif mm[:6] in (b'GIF87a', b'GIF89a'):
+                    return HeaderParser.parse_gif(mm)
+                elif mm[:4] == b'RIFF' and mm[8:12] == b'WEBP':
+                    return HeaderParser.parse_webp(mm)
+                elif mm[:4] == b'\x1a\x45\xdf\xa3':
+                    return HeaderParser.parse_matroska(mm)
+            except (IndexError, ValueError, struct.error):
+                return
+
+    @staticmethod
+    def get_fps(frames, duration_ms):
+        if frames > 1 and duration_ms > 0:
+            return HeaderParser.round_fps(frames / duration_ms * 1000)
+        else:
+            return 1
+
+    @staticmethod
+    def round_fps(fps):
+        # 33 ms frames are 30 fps, not 30.30 fps that fails a limit of 30
+        fps_int = max(1, round(fps))
+        if abs(1000 / fps - 1000 / fps_int) <= HeaderParser.FPS_SNAP_MS:
+            return fps_int
+        return round(fps, 3)
+
+    @staticmethod
+    def parse_png(mm):
+        width, height, _, color_type = struct.unpack_from('>IIBB', mm, 16)
+        alpha = color_type in (4, 6)
+        frames = 1
+        duration_ms = 0
+
+        pos = 8
+        while pos + 8 <= len(mm):
+            length, chunk_type = struct.unpack_from('>I4s', mm, pos)
+            data_pos = pos + 8
+
+            if chunk_type == b'tRNS':
+                alpha = True
+            elif chunk_type == b'acTL':
+                frames = struct.unpack_from('>I', mm, data_pos)[0]
+            elif chunk_type == b'fcTL':
+                delay_num, delay_den = struct.unpack_from('>HH', mm, data_pos + 20)
+                duration_ms += delay_num / (delay_den or 100) * 1000
+            elif chunk_type == b'IDAT' and frames == 1:
+                # Not an APNG, nothing useful after image data
+                break
+            elif chunk_type == b'IEND':
+                break
+
+            pos = data_pos + length + 4 # Skip data and CRC
+
+        return {
+            'width': width,
+            'height': height,
+            'frames': frames,
+            'fps': HeaderParser.get_fps(frames, duration_ms),
+            'codec': 'apng' if frames > 1 else 'png',
+            'alpha': alpha
+        }
+
+    @staticmethod
+    def parse_gif(mm):
+        width, height, flags = struct.unpack_from('<HHB', mm, 6)
+        alpha = False
+        frames = 0
+        duration_ms = 0
+        delay = 0
+
+        pos = 13
+        if flags & 0x80:
+            pos += 3 * 2 ** ((flags & 0x07) + 1)
+
+        while pos < len(mm):
+            block = mm[pos]
+            if block == 0x21:
+                # Extension
+                if mm[pos + 1] == 0xf9:
+                    gce_flags, delay = struct.unpack_from('<BH', mm, pos + 3)
+                    alpha = alpha or bool(gce_flags & 0x01)
+                pos += 2
+            elif block == 0x2c:
+                # Image descriptor
+                flags = mm[pos + 9]
+                pos += 10
+                if flags & 0x80:
+                    pos += 3 * 2 ** ((flags & 0x07) + 1)
+                pos += 1 # LZW minimum code size
+
+                # Browsers and ffmpeg play delay below 2 centiseconds as 10
+                frames += 1
+                duration_ms += (delay if delay >= 2 else 10) * 10
+                delay = 0
+            elif block == 0x3b:
+                # Trailer
+                break
+            else:
+                raise ValueError(f'Unknown GIF block {block}')
+
+            # Skip data sub-blocks
+            while mm[pos] != 0:
+                pos += mm[pos] + 1
+            pos += 1
+
+        return {
+            'width': width,
+            'height': height,
+            'frames': frames,
+            'fps': HeaderParser.get_fps(frames, duration_ms),
+            'codec': 'gif',
+            'alpha': alpha
+        }
+
+    @staticmethod
+    def parse_webp(mm):
+        width, height = None, None
+        alpha = False
+        frames = 0
+        duration_ms = 0
+
+        pos = 12
+        while pos + 8 <= len(mm):
+            chunk_type, length = struct.unpack_from('<4sI', mm, pos)
+            data_pos = pos + 8
+
+            if chunk_type == b'VP8X':
+                alpha = bool(mm[data_pos] & 0x10)
+                width = int.from_bytes(mm[data_pos + 4:data_pos + 7], 'little') + 1
+                height = int.from_bytes(mm[data_pos + 7:data_pos + 10], 'little') + 1
+            elif chunk_type == b'ANMF':
+                frames += 1
+                # Frame duration is 24 bits long, followed by 8 bits of flags
+                duration_ms += int.from_bytes(mm[data_pos + 12:data_pos + 15], 'little')
+            elif chunk_type == b'ALPH':
+                alpha = True
+            elif chunk_type == b'VP8 ' and width == None:
+                w, h = struct.unpack_from('<HH', mm, data_pos + 6)
+                width, height = w & 0x3fff, h & 0x3fff
+            elif chunk_type == b'VP8L' and width == None:
+                bits = struct.unpack_from('<I', mm, data_pos + 1)[0]
+                width = (bits & 0x3fff) + 1
+                height = ((bits >> 14) & 0x3fff) + 1
+                alpha = bool((bits >> 28) & 0x01)
+
+            pos = data_pos + length + (length & 1) # Chunks are padded to even size
+
+        frames = max(frames, 1)
+
+        return {
+            'width': width,
+            'height': height,
+            'frames': frames,
+            'fps': HeaderParser.get_fps(frames, duration_ms),
+            'codec': 'webp',
+            'alpha': alpha
+        }
+
+    @staticmethod
+    def read_ebml_vint(mm, pos, strip_marker=True):
+        first = mm[pos]
+        length = 1
+        while length <= 8 and not first & (0x80 >> (length - 1)):
+            length += 1
+        if length > 8:
+            raise ValueError('Invalid EBML variable size integer')
+
+        value = int.from_bytes(mm[pos:pos + length], 'big')
+        if strip_marker:
+            value &= (1 << (7 * length)) - 1
+            if value == (1 << (7 * length)) - 1:
+                # Unknown size
+                value = None
+        return value, pos + length
+
+    @staticmethod
+    def parse_matroska(mm):
+        codec_ids = {
+            'V_VP8': 'vp8',
+            'V_VP9': 'vp9',
+            'V_AV1': 'av1',
+            'V_MPEG4/ISO/AVC': 'h264',
+            'V_MPEGH/ISO/HEVC': 'hevc'
+        }
+
+        # Elements that only contain other elements and are walked into
+        master_ids = (
+            0x18538067, # Segment
+            0x1549a966, # Info
+            0x1654ae6b, # Tracks
+            0xae,       # TrackEntry
+            0xe0,       # Video
+            0x1f43b675, # Cluster
+            0xa0        # BlockGroup
+        )
+
+        timecode_scale = 1000000
+        duration_ns = None
+        tracks = []
+        blocks = {}
+
+        pos = 0
+        end = len(mm)
+        while pos < end:
+            element_id, pos = HeaderParser.read_ebml_vint(mm, pos, strip_marker=False)
+            size, pos = HeaderParser.read_ebml_vint(mm, pos)
+
+            if element_id in master_ids:
+                if size == None and element_id != 0x18538067:
+                    # Only unknown sized Segment (Which runs until end of file) is handled
+                    return
+                if element_id == 0xae:
+                    tracks.append({})
+                continue
+            elif size == None:
+                return
+
+            data = mm[pos:pos + size]
+            if element_id == 0x2ad7b1:
+                timecode_scale = int.from_bytes(data, 'big')
+            elif element_id == 0x4489:
+                duration_ns = struct.unpack('>f' if size == 4 else '>d', data)[0]
+            elif element_id == 0xd7:
+                tracks[-1]['number'] = int.from_bytes(data, 'big')
+            elif element_id == 0x83:
+                tracks[-1]['type'] = int.from_bytes(data, 'big')
+            elif element_id == 0x86:
+                tracks[-1]['codec'] = data.decode('ascii', 'ignore').rstrip('\x00')
+            elif element_id == 0x23e383:
+                tracks[-1]['default_duration'] = int.from_bytes(data, 'big')
+            elif element_id == 0xb0:
+                tracks[-1]['width'] = int.from_bytes(data, 'big')
+            elif element_id == 0xba:
+                tracks[-1]['height'] = int.from_bytes(data, 'big')
+            elif element_id == 0x53c0:
+                tracks[-1]['alpha'] = int.from_bytes(data, 'big') == 1
+            elif element_id in (0xa3, 0xa1):
+                # SimpleBlock or Block, starting with track number
+                track_number, _ = HeaderParser.read_ebml_vint(mm, pos)
+                blocks[track_number] = blocks.get(track_number, 0) + 1
+
+            pos += size
+
+        video_tracks = [i for i in tracks if i.get('type') == 1]
+        if not video_tracks:
+            return
+        track = video_tracks[0]
+        frames = blocks.get(track.get('number'), 0)
+
+        if duration_ns != None:
+            duration_ns *= timecode_scale
+        if track.get('default_duration'):
+            fps = HeaderParser.round_fps(1000000000 / track['default_duration'])
+        elif duration_ns:
+            fps = HeaderParser.get_fps(frames, duration_ns / 1000000)
+        else:
+            return
+
+        return {
+            'width': track.get('width'),
+            'height': track.get('height'),
+            'frames': frames,
+            'fps': fps,
+            'codec': codec_ids.get(track.get('codec'), track.get('codec', '').lower()),
+            'alpha': track.get('alpha', False)
+        }
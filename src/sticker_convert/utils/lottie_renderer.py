@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import os
+import ctypes
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python 3.7, frames are rendered in this process only
+    shared_memory = None
+
+import numpy as np
+from rlottie_python import LottieAnimation
+from rlottie_python.rlottie_wrapper import LottieAnimationPointer
+
+class LottieRenderer:
+    '''
+    Render frames of a lottie file (.tgs or .json) straight into a numpy
+    buffer at the requested size, without going through Pillow.
+    '''
+    # Rendering is split across processes only if it is expected to take
+    # longer than this (In seconds), with at least this many frames each
+    PARALLEL_TIME_MIN = 1
+    FRAMES_PER_PROCESS_MIN = 16
+
+    def __init__(self, file, width, height):
+        if os.path.splitext(file)[-1].lower() == '.tgs':
+            self.anim = LottieAnimation.from_tgs(file)
+        else:
+            self.anim = LottieAnimation.from_file(file)
+
+        self.width = width
+        self.height = height
+        # rlottie renders premultiplied ARGB32, which is BGRA in memory
+        self.buffer = np.empty((height, width, 4), dtype=np.uint8)
+
+        render = self.anim.rlottie_lib.lottie_animation_render
+        render.argtypes = [LottieAnimationPointer, ctypes.c_size_t, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t]
+        render.restype = None
+        self.render_c = render
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # Only the animation is destroyed, lottie_shutdown() would
+        # stop rlottie for other conversions running in this process
+        self.anim.lottie_animation_destroy()
+
+    def render(self, frame_num, out=None):
+        self.render_c(
+            self.anim.animation_p,
+            frame_num,
+            self.buffer.ctypes.data_as(ctypes.c_void_p),
+            self.width,
+            self.height,
+            self.width * 4
+        )
+
+        if out is None:
+            out = np.empty_like(self.buffer)
+        # BGRA -> RGBA
+        out[..., 0] = self.buffer[..., 2]
+        out[..., 1] = self.buffer[..., 1]
+        out[..., 2] = self.buffer[..., 0]
+        out[..., 3] = self.buffer[..., 3]
+        return out
+
+    @staticmethod
+    def render_parallel(file, width, height, frames_num, processes):
+        '''
+        Render frames_num with up to processes workers, each holding its own
+        animation and writing its range of frames into shared memory.
+        Return an array of shape (len(frames_num), height, width, 4).
+        '''
+        shape = (len(frames_num), height, width, 4)
+        frames = np.empty(shape, dtype=np.uint8)
+
+        with LottieRenderer(file, width, height) as renderer:
+            # Time one frame from the middle to see if starting workers pays off
+            middle = len(frames_num) // 2
+            time_start = time.perf_counter()
+            renderer.render(frames_num[middle], out=frames[middle])
+            time_render = (time.perf_counter() - time_start) * len(frames_num)
+
+            processes = min(processes, len(frames_num) // LottieRenderer.FRAMES_PER_PROCESS_MIN)
+            if shared_memory == None or processes <= 1 or time_render < LottieRenderer.PARALLEL_TIME_MIN:
+                for i, frame_num in enumerate(frames_num):
+                    if i != middle:
+                        renderer.render(frame_num, out=frames[i])
+                return frames
+
+        shm = shared_memory.SharedMemory(create=True, size=frames.nbytes)
+        try:
+            # rlottie keeps its own threads, so workers are spawned instead of forked
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+                jobs = []
+                for i in range(processes):
+                    start = len(frames_num) * i // processes
+                    end = len(frames_num) * (i + 1) // processes
+                    jobs.append(executor.submit(LottieRenderer.render_worker, file, shape, shm.name, start, frames_num[start:end]))
+                for job in jobs:
+                    job.result()
+
+            frames[:] = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return frames
+
+    @staticmethod
+    def render_worker(file, shape, shm_name, start, frames_num):
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            with LottieRenderer(file, shape[2], shape[1]) as renderer:
+                for i, frame_num in enumerate(frames_num):
+                    renderer.render(frame_num, out=frames[start + i])
+            del frames
+        finally:
+            shm.close()
\ No newline at end of file
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import os
+from functools import lru_cache
+
+import av
+from PIL import Image, UnidentifiedImageError
+from rlottie_python import LottieAnimation
+
+from .header_parser import HeaderParser
+
+class MediaInfo:
+    '''
+    Probe a file once for everything the converter, verifier and uploaders
+    need to know about it. Use MediaInfo.probe(file) to get a cached result,
+    which is reused until the file is modified.
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.ext = os.path.splitext(file)[-1].lower()
+
+        self.width = None
+        self.height = None
+        self.fps = None
+        self.frames = None
+        self.codec = None
+        self.alpha = None
+
+        if self.ext in ('.tgs', '.lottie', '.json'):
+            self.probe_lottie()
+        elif not self.probe_header():
+            try:
+                self.probe_pillow()
+            except UnidentifiedImageError:
+                self.probe_pyav()
+
+    @staticmethod
+    def probe(file):
+        stat = os.stat(file)
+        return MediaInfo._probe_cached(os.path.abspath(file), stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _probe_cached(file, mtime, size):
+        return MediaInfo(file)
+
+    @property
+    def res(self):
+        return self.width, self.height
+
+    @property
+    def duration(self):
+        # Return duration in miliseconds
+        return self.frames / self.fps * 1000
+
+    @property
+    def anim(self):
+        return self.frames > 1
+
+    def probe_lottie(self):
+        if self.ext == '.tgs':
+            anim = LottieAnimation.from_tgs(self.file)
+        else:
+            anim = LottieAnimation.from_file(self.file)
+
+        with anim:
+            self.width, self.height = anim.lottie_animation_get_size()
+            self.fps = anim.lottie_animation_get_framerate()
+            self.frames = anim.lottie_animation_get_totalframe()
+        self.codec = 'lottie'
+        self.alpha = True
+
+    def probe_header(self):
+        info = HeaderParser.parse(self.file)
+        if not info or None in info.values():
+            return False
+
+        self.width = info['width']
+        self.height = info['height']
+        self.fps = info['fps']
+        self.frames = info['frames']
+        self.codec = info['codec']
+        self.alpha = info['alpha']
+        return True
+
+    def probe_pillow(self):
+        with Image.open(self.file) as im:
+            self.width, self.height = im.size
+            self.frames = getattr(im, 'n_frames', 1)
+            self.alpha = im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info
+
+            self.fps = HeaderParser.round_fps(1000 / (im.info.get('duration') or 1000))
+
+            if im.format == 'PNG':
+                self.codec = 'apng' if self.frames > 1 else 'png'
+            elif im.format == 'JPEG':
+                self.codec = 'mjpeg'
+            else:
+                self.codec = im.format.lower()
+
+    def probe_pyav(self):
+        with av.open(self.file) as container:
+            stream = container.streams.video[0]
+            self.width = stream.codec_context.width
+            self.height = stream.codec_context.height
+            self.fps = float(stream.guessed_rate or stream.average_rate or 1)
+            self.codec = stream.codec_context.name
+
+            pix_fmt = stream.codec_context.pix_fmt
+            self.alpha = (stream.metadata.get('alpha_mode') == '1' or
+                          (pix_fmt != None and any(c.is_alpha for c in av.VideoFormat(pix_fmt).components)))
+
+            # Count packets instead of decoding frames if container does not store frame count
+            self.frames = stream.frames
+            if not self.frames:
+                self.frames = sum(1 for packet in container.demux(stream) if packet.size > 0)
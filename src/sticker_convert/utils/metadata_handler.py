@@ -3,6 +3,7 @@ import os
 import json
 
 from .codec_info import CodecInfo
+from .media_info import MediaInfo
 from .json_manager import JsonManager
 
 class MetadataHandler:
@@ -133,7 +134,7 @@ class MetadataHandler:
             for file in stickers_present:
                 file_path = os.path.join(dir, file)
 
-                if CodecInfo.is_anim(file_path):
+                if MediaInfo.probe(file_path).anim:
                     anim_stickers.append(file_path)
                 else:
                     image_stickers.append(file_path)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import numpy as np
+from PIL import Image
+
+class PaletteQuantizer:
+    '''
+    Map RGBA frames one at a time to a fixed palette of RGBA colors.
+
+    Pillow can only quantize RGB images to a given palette, so each pixel is
+    mapped to its nearest palette color here instead. Nearest palette color
+    of each RGBA color seen so far is kept, and reused for later frames.
+    '''
+    # Number of frames sampled to build the palette
+    SAMPLE_FRAMES = 16
+    # Number of colors compared to the palette at once, to bound memory
+    CHUNK_COLORS = 4096
+
+    def __init__(self, palette):
+        self.palette = palette
+        self.palette_premul = PaletteQuantizer.premultiply(palette.astype(np.float32))
+        self.palette_norm = (self.palette_premul ** 2).sum(axis=1)
+        # Colors seen so far as sorted uint32, and their palette indices
+        self.keys = np.empty(0, dtype=np.uint32)
+        self.indices = np.empty(0, dtype=np.uint8)
+
+    @staticmethod
+    def from_frames(frames, colors):
+        # frames is an array of shape (n, height, width, 4)
+        step = max(1, len(frames) // PaletteQuantizer.SAMPLE_FRAMES)
+        sample = frames[::step][:PaletteQuantizer.SAMPLE_FRAMES].reshape(-1, frames.shape[2], 4)
+        image_quant = Image.fromarray(sample, 'RGBA').quantize(colors=colors, method=2)
+        palette = np.array(image_quant.getpalette(rawmode='RGBA'), dtype=np.uint8).reshape(-1, 4)
+        # getpalette() pads to 256 colors, only keep those used
+        palette = palette[np.unique(np.asarray(image_quant))]
+        # Transparent colors first, so that tRNS chunk only covers them
+        palette = palette[np.argsort(palette[:, 3] == 255, kind='stable')]
+        return PaletteQuantizer(palette)
+
+    @staticmethod
+    def premultiply(colors):
+        # Color of mostly transparent pixels matters less
+        premul = colors.copy()
+        premul[:, :3] *= colors[:, 3:] / 255
+        return premul
+
+    def quantize(self, frame):
+        pixels = frame.view(np.uint32).ravel()
+
+        pos = np.searchsorted(self.keys, pixels)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == pixels[found]
+
+        if not found.all():
+            colors_new = np.unique(pixels[~found])
+            indices_new = np.empty(len(colors_new), dtype=np.uint8)
+            for i in range(0, len(colors_new), PaletteQuantizer.CHUNK_COLORS):
+                chunk = colors_new[i:i + PaletteQuantizer.CHUNK_COLORS].view(np.uint8).reshape(-1, 4)
+                chunk = PaletteQuantizer.premultiply(chunk.astype(np.float32))
+                # Squared distance without the term of chunk, which is the same for each palette color
+                distances = self.palette_norm - 2 * chunk @ self.palette_premul.T
+                indices_new[i:i + PaletteQuantizer.CHUNK_COLORS] = distances.argmin(axis=1)
+
+            # colors_new is sorted, so inserting keeps keys sorted
+            pos_new = np.searchsorted(self.keys, colors_new)
+            self.keys = np.insert(self.keys, pos_new, colors_new)
+            self.indices = np.insert(self.indices, pos_new, indices_new)
+            pos = np.searchsorted(self.keys, pixels)
+
+        return self.indices[pos].reshape(frame.shape[:2])
\ No newline at end of file
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import numpy as np
+import av
+from PIL import Image
+
+from sticker_convert.utils.format_verify import FormatVerify
+
+def test_check_file_size_static_over_img_limit(tmp_path):
+    # Noise does not compress, so the file is larger than the img limit
+    file = str(tmp_path / 'static.png')
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (64, 64, 4), dtype=np.uint8)).save(file)
+    size = {'img': 1000, 'vid': 1000000}
+
+    assert FormatVerify.check_file_size(file, size=size) == False
+    assert FormatVerify.check_file_size(file, size={'img': 1000000, 'vid': 1000}) == True
+
+def test_check_file_size_anim_over_vid_limit(tmp_path):
+    file = str(tmp_path / 'anim.png')
+    rng = np.random.default_rng(0)
+    frames = [Image.fromarray(rng.integers(0, 256, (64, 64, 4), dtype=np.uint8)) for _ in range(2)]
+    frames[0].save(file, save_all=True, append_images=frames[1:])
+
+    assert FormatVerify.check_file_size(file, size={'img': 1000000, 'vid': 1000}) == False
+    assert FormatVerify.check_file_size(file, size={'img': 1000, 'vid': 1000000}) == True
+
+def test_check_file_fps_30_fps_apng(tmp_path):
+    # 33 ms is how 30 fps is stored in miliseconds
+    file = str(tmp_path / 'anim.png')
+    frames = [Image.new('RGBA', (64, 64), (i, 0, 0, 255)) for i in range(3)]
+    frames[0].save(file, save_all=True, append_images=frames[1:], duration=33)
+
+    assert FormatVerify.check_file_fps(file, fps={'min': 1, 'max': 30}) == True
+    assert FormatVerify.check_file_fps(file, fps={'min': 1, 'max': 29}) == False
+
+def test_check_file_fps_30_fps_webm(tmp_path):
+    file = str(tmp_path / 'anim.webm')
+    with av.open(file, 'w', format='webm') as output:
+        stream = output.add_stream('vp9', rate=30)
+        stream.width = 64
+        stream.height = 64
+        stream.pix_fmt = 'yuv420p'
+        for i in range(3):
+            frame = av.VideoFrame.from_ndarray(np.full((64, 64, 3), i, dtype=np.uint8), format='rgb24')
+            for packet in stream.encode(frame):
+                output.mux(packet)
+        for packet in stream.encode():
+            output.mux(packet)
+
+    assert FormatVerify.check_file_fps(file, fps={'min': 1, 'max': 30}) == True
+    assert FormatVerify.check_file_fps(file, fps={'min': 1, 'max': 29}) == False
\ No newline at end of file